@@ -0,0 +1,85 @@
+"""
+fixed positions for the benchmarks, replayed from seeded random games so every run
+(and every engine version) benchmarks the same boards.
+"""
+__author__ = 'reut'
+
+import random
+
+from connect4.logic import game
+
+# (name, rows, columns, goal, plies, seed)
+POSITIONS = (
+    ("opening-6x7", 6, 7, 4, 2, 1),
+    ("midgame-6x7", 6, 7, 4, 16, 2),
+    ("midgame-8x9", 8, 9, 4, 24, 3),
+) + tuple(
+    ("full-15x15-goal%d" % goal, 15, 15, goal, 150, 10 + goal) for goal in xrange(3, 11)
+)
+# (name, rows, columns, goal, seed) - random play until the player to move can win at once
+NEAR_WINS = (
+    ("near-win-6x7", 6, 7, 4, 4),
+    ("near-win-15x15", 15, 15, 5, 5),
+)
+
+_players = None
+
+
+def players():
+    # two players for every corpus board, made once (player ids are limited)
+    global _players
+    if _players is None:
+        _players = [game.HumanPlayer("a"), game.HumanPlayer("b")]
+    return _players
+
+
+def play(board, rng):
+    # a random move that doesn't end the game, None if there is none
+    moves = list(board.valid_moves_iterator)
+    rng.shuffle(moves)
+    for move in moves:
+        board.put_one(move)
+        if not board.get_winner():
+            return move
+        board.undo()
+    return None
+
+
+def can_win(board):
+    for move in list(board.valid_moves_iterator):
+        board.put_one(move)
+        won = bool(board.winner)
+        board.undo()
+        if won:
+            return True
+    return False
+
+
+def position(rows, columns, goal, plies, seed):
+    rng = random.Random(seed)
+    board = game.Board(players(), rows, columns, goal)
+    board.current_player = players()[0]
+    for _ in xrange(plies):
+        if play(board, rng) is None:
+            break
+    return board
+
+
+def near_win(rows, columns, goal, seed):
+    rng = random.Random(seed)
+    board = game.Board(players(), rows, columns, goal)
+    board.current_player = players()[0]
+    while not can_win(board):
+        if play(board, rng) is None:
+            break
+    return board
+
+
+def corpus():
+    """
+    [(name, board)] of the whole corpus
+    """
+    boards = [(name, position(rows, columns, goal, plies, seed))
+              for name, rows, columns, goal, plies, seed in POSITIONS]
+    boards += [(name, near_win(rows, columns, goal, seed)) for name, rows, columns, goal, seed in NEAR_WINS]
+    return boards
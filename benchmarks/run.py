@@ -0,0 +1,143 @@
+"""
+micro benchmarks of the Board and MinMaxStrategy hot paths over the fixed corpus.
+
+    python -m benchmarks run --output baseline.json
+    python -m benchmarks compare baseline.json --threshold 0.1
+
+results are seconds per operation (best of several repeats), keyed by benchmark and position.
+compare exits with 1 when any benchmark got slower than the baseline by more than the threshold.
+"""
+__author__ = 'reut'
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from connect4.logic import AI
+
+from benchmarks.corpus import corpus
+
+SEARCH_DEPTHS = (2, 4, 6)
+# boards searched by get_move - big boards only get the shallow depths
+SEARCH_LIMITS = {"opening-6x7": 6, "midgame-6x7": 6, "midgame-8x9": 4, "near-win-6x7": 6, "near-win-15x15": 2}
+
+
+def timed(function, number, repeat):
+    # best seconds per call of function over repeat runs of number calls
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = (time.time() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def put_one_undo(board):
+    moves = list(board.valid_moves_iterator)
+
+    def run():
+        for move in moves:
+            board.put_one(move)
+            board.undo()
+    return run
+
+
+def nrun_iterator(board):
+    def run():
+        for nrun in board.nrun_iterator:
+            list(nrun)
+    return run
+
+
+def heuristic_value(board):
+    heuristic = AI.AvailableVictoriesHeuristic(board.current_player)
+    return lambda: heuristic.value(board)
+
+
+def get_move(board, depth):
+    # a new strategy (and table) every call, so repeats don't answer from the previous one
+    return lambda: AI.MinMaxStrategy(AI.AvailableVictoriesHeuristic(board.current_player)).get_move(board, depth)
+
+
+def benchmarks(boards, quick=False):
+    """
+    [(name, function, number)] for every benchmark on every board
+    """
+    scale = 10 if quick else 1
+    cases = []
+    for position, board in boards:
+        cases.append(("put_one_undo/" + position, put_one_undo(board), max(1, 2000 // scale)))
+        cases.append(("get_winner/" + position, board.get_winner, max(1, 20000 // scale)))
+        cases.append(("nrun_iterator/" + position, nrun_iterator(board), max(1, 100 // scale)))
+        cases.append(("heuristic_value/" + position, heuristic_value(board), max(1, 20000 // scale)))
+        for depth in SEARCH_DEPTHS:
+            if depth <= SEARCH_LIMITS.get(position, 0) and not (quick and depth > 4):
+                cases.append(("get_move-depth%d/%s" % (depth, position), get_move(board, depth), 1))
+    return cases
+
+
+def run(repeat=3, quick=False, only=None):
+    results = {}
+    for name, function, number in benchmarks(corpus(), quick):
+        if only and only not in name:
+            continue
+        results[name] = timed(function, number, repeat)
+        sys.stderr.write("%-45s %12.3f us\n" % (name, results[name] * 1e6))
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    [(name, baseline seconds, current seconds, change)] of benchmarks slower by more than threshold
+    """
+    regressions = []
+    for name, seconds in sorted(current["results"].items()):
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        change = seconds / before - 1
+        if change > threshold:
+            regressions.append((name, before, seconds, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the connect 4 engine.")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results")
+    run_parser.add_argument("--output", help="json file for the results (stdout by default)")
+    compare_parser = commands.add_parser("compare", help="run the benchmarks and compare with a baseline")
+    compare_parser.add_argument("baseline", help="json file saved by run")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="allowed slowdown as a fraction of the baseline (default 0.1)")
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument("--repeat", type=int, default=3)
+        subparser.add_argument("--quick", action="store_true", help="fewer iterations and shallower searches")
+        subparser.add_argument("--only", help="only benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    current = run(args.repeat, args.quick, args.only)
+    if args.command == "run":
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(current, output, indent=2, sort_keys=True)
+        else:
+            print json.dumps(current, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(baseline, current, args.threshold)
+    for name, before, seconds, change in regressions:
+        print "REGRESSION %-45s %12.3f us -> %12.3f us (+%.0f%%)" % (name, before * 1e6, seconds * 1e6, change * 100)
+    if not regressions:
+        print "no regressions beyond %.0f%%" % (args.threshold * 100)
+    return 1 if regressions else 0
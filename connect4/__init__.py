@@ -1,4 +1,20 @@
+"""
+connect 4 engine (connect4.logic) and its Tk GUI (connect4.gui), which only starts from main:
+
+    connect4                # console script
+    python -m connect4
+
+the modules log to children of the "connect4" logger and leave handlers to the application.
+"""
 __author__ = 'reut'
 
-from connect4.gui import gui
-gui.main()
+import logging
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+logging.getLogger("connect4").addHandler(logging.NullHandler())
+
+
+def configure_logging(level=logging.WARN):
+    # for entry points: warnings and errors of every module to stderr
+    logging.basicConfig(format=LOG_FORMAT, level=level)
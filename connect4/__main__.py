@@ -0,0 +1,5 @@
+__author__ = 'reut'
+
+from connect4.gui import gui
+
+gui.main()
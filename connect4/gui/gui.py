@@ -1,17 +1,14 @@
 import Tkinter as Tk
+from connect4 import configure_logging
 from connect4.logic import game
+from connect4.logic.book import get_book
+from connect4.gui.worker import AnalysisWorker
 import logging
 import Queue
 import time
 import threading
 
-LOGGER = logging.getLogger("connect4-gui")
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-sh = logging.StreamHandler()
-sh.setFormatter(formatter)
-sh.setLevel(logging.DEBUG)
-LOGGER.addHandler(sh)
-LOGGER.setLevel(logging.WARN)
+LOGGER = logging.getLogger("connect4.gui")
 
 
 def show_pre_game_menu(old, root):
@@ -243,17 +240,123 @@ class GameBoard(Tk.Frame):
 
         self.undo_button = Tk.Button(self, text="Undo", fg="red", bg="black", command=self.undo)
         self.undo_button.pack()
+        self.redo_button = Tk.Button(self, text="Redo", fg="red", bg="black", command=self.redo)
+        self.redo_button.pack()
         self.tip = Tk.StringVar(self)
         self.tip_label = Tk.Label(self, background="bisque", textvariable=self.tip)
         self.tip_label.pack()
 
         self.win_button = None
 
+        # searches (tips and computer moves) run on a worker thread, results are polled from the main loop
+        self.worker = AnalysisWorker()
+        self.worker.start()
+        self.tip_position = None
+        # opponent's predicted move for the human to play, its reply is pondered meanwhile
+        self.prediction = None
+        self.poll_rate = 50
+        self.poll_job = self.after(self.poll_rate, self.poll_worker)
+
+        # one oval per cell, created once and then recolored and rescaled in place
+        self.cells = {}
+        self.cell_colors = {}
+        for row in range(self.rows):
+            for col in range(self.columns):
+                self.cells[row, col] = self.canvas.create_oval(
+                    self.cell_coords(row, col), outline="black", fill="white", tags="pieces"
+                )
+                self.cell_colors[row, col] = "white"
+        # resize events are coalesced, the latest size is applied at most once a frame
+        self.frame_rate = 16
+        self.resize_job = None
+        self.after_idle(self.refresh)
+
         # self.game.start()
 
+    def position(self):
+        return self.board.position_key()
+
+    def destroy(self):
+        self.after_cancel(self.poll_job)
+        if self.resize_job:
+            self.after_cancel(self.resize_job)
+        self.worker.shutdown()
+        Tk.Frame.destroy(self)
+
+    def poll_worker(self):
+        while not self.worker.results.empty():
+            kind, position, result = self.worker.results.get()
+            if position != self.position():
+                LOGGER.debug("dropped stale %s", kind)
+                continue
+            if kind == "tip":
+                self.tip.set("%s" % str(result[1][0]))
+            elif kind == "prediction":
+                self.prediction = result[1][0]
+                self.tip.set("%s" % str(result[1][0]))
+            elif kind == "move":
+                self.played(self.board.current_player, result)
+            elif kind == "error":
+                self.tip.set("")
+                self.player_indicator.set("Analysis failed: %s" % result)
+                if not self.board.get_winner():
+                    self.canvas.bind("<Button-1>", self.put_one_event)
+        self.poll_job = self.after(self.poll_rate, self.poll_worker)
+
+    def request_tip(self):
+        if self.tip_position == self.position():
+            return
+        self.tip_position = self.position()
+        self.tip.set("thinking...")
+        self.prediction = None
+        board = self.board.copy()
+        opponent = self.board.players[(self.board.current_index + 1) % len(self.board.players)]
+        if isinstance(board.current_player, game.HumanPlayer) and isinstance(opponent, game.ComputerMinMaxPlayer):
+            # the opponent's prediction is the tip, then it ponders its reply while the human thinks
+            self.worker.submit("prediction", self.position(), opponent.strategy, lambda: opponent.predict(board))
+            self.worker.submit("ponder", self.position(), opponent.strategy, lambda: opponent.ponder(board))
+            return
+        if isinstance(board.current_player, game.ComputerMinMaxPlayer):
+            # the computer's own search is the tip, nothing is queued ahead of its move
+            found = self.engine_tip(board)
+            if found is not None:
+                self.tip.set("%s" % str(found))
+            return
+        book = get_book(board.rows, board.columns, board.goal, len(board.players))
+        found = book.lookup(board) if book is not None else None
+        if found is not None:
+            self.tip.set("%s" % str(found[0]))
+            return
+        strategy = game.MinMaxStrategy(board.tipheuristic(board.current_player))
+        self.worker.submit("tip", self.position(), strategy, lambda: strategy.search(board, 4))
+
+    def engine_tip(self, board):
+        """
+        the move a computer player to move on board is expected to play, from work already done:
+        its pondered search, a computer's last variation leading here or the opening book. None if unknown
+        """
+        player = board.current_player
+        key = board.position_key()
+        if player.pondered is not None and player.pondered[0] == key:
+            return player.pondered[1][1][0]
+        for other in board.players:
+            last_search = getattr(other, "last_search", None)
+            if last_search is not None and last_search[0] == key and last_search[1][1]:
+                return last_search[1][1][0]
+        found = player.book_move(board)
+        return found and found[1][0]
+
+    def request_computer_move(self, column):
+        self.canvas.unbind("<Button-1>")
+        player = self.board.current_player
+        board = self.board.copy()
+        self.player_indicator.set("%s player is thinking..." % player.get_color())
+        self.worker.submit("move", self.position(), player.strategy, lambda: player.get_move(board, column))
+
     def undo(self):
         if self.win_button:
             self.win_button.destroy()
+        self.worker.cancel()
         try:
             # remove two pieces and put one back to re-do all logic of last put event
             removed = self.board.undo()
@@ -266,11 +369,32 @@ class GameBoard(Tk.Frame):
         self.player_indicator.set("%s cheats! removes piece from %s" % (self.board.current_player.get_color(), removed))
         self.refresh()
 
+    def redo(self):
+        # the board's history keeps undone moves, the last one undone here is played again
+        column = self.board.redo_column()
+        if column is None:
+            self.player_indicator.set("Nothing to redo.")
+            return
+        self.worker.cancel()
+        self.played(self.board.current_player, column)
+
     def resize_event(self, event):
         x_size = int((event.width-1) / self.columns)
         y_size = int((event.height-1) / self.rows)
         self.cell_size = min(x_size, y_size)
-        self.refresh()
+        if not self.resize_job:
+            self.resize_job = self.after(self.frame_rate, self.rescale)
+
+    def rescale(self):
+        self.resize_job = None
+        for (row, col), item in self.cells.iteritems():
+            self.canvas.coords(item, *self.cell_coords(row, col))
+        LOGGER.debug("rescaled canvas")
+
+    def cell_coords(self, row, col):
+        x1 = (col * self.cell_size)
+        y1 = (row * self.cell_size)
+        return x1, y1, x1 + self.cell_size, y1 + self.cell_size
 
     def put_one(self, column):
         try:
@@ -279,10 +403,8 @@ class GameBoard(Tk.Frame):
             if isinstance(self.board.current_player, game.HumanPlayer):
                 # pass control to mouse button
                 self.canvas.bind("<Button-1>", self.put_one_event)
-            else:
-                self.canvas.bind(
-                    "<Button-1>", lambda x: self.put_one(self.board.current_player.get_move(self.board, column))
-                )
+            elif not self.board.get_winner():
+                self.canvas.bind("<Button-1>", lambda x: self.request_computer_move(column))
         except game.NotYourTurnError as e:
             raise e
         except game.LocationTakenError as e:
@@ -292,21 +414,18 @@ class GameBoard(Tk.Frame):
 
     def refresh(self):
         self.configure(bg=self.board.current_player.get_color())
-        self.canvas.delete("pieces")
-        for row in range(self.rows):
-            for col in range(self.columns):
-                x1 = (col * self.cell_size)
-                y1 = (row * self.cell_size)
-                x2 = x1 + self.cell_size
-                y2 = y1 + self.cell_size
-                color = (self.board.get_piece(row, col) and self.board.get_piece(row, col).owner.get_color()) or "white"
-                self.canvas.create_oval(x1, y1, x2, y2, outline="black", fill=color, tags="pieces")
-        self.canvas.tag_raise("pieces")
+        # only cells that changed since the last refresh (the last move or undo) are recolored
+        for (row, col), item in self.cells.iteritems():
+            owner = self.board.get_owner(row, col)
+            color = (owner and owner.get_color()) or "white"
+            if self.cell_colors[row, col] != color:
+                self.canvas.itemconfig(item, fill=color)
+                self.cell_colors[row, col] = color
         if self.board.get_winner():
             self.tip.set("Game over - %s won." % self.board.current_player)
         else:
             # self.tip.set("%(score)d, %(moves)s" % self.board.tip_strategy(self.board.current_player))
-            self.tip.set("%s" % str(self.board.tip_strategy(self.board.current_player).moves[len(self.board.moves):][0][2]))
+            self.request_tip()
         # estimated scores:
         print "scores: %s" % '\n'.join(str(player) for player in self.board.players)
         # for player in self.board.players:
@@ -320,11 +439,20 @@ class GameBoard(Tk.Frame):
         self.canvas.unbind("<Button-1>")
         player = self.board.current_player
         pressed_column = self.get_normalized_coords(event)[0]
-        column = self.board.current_player.get_move(self.board, pressed_column)
+        if not isinstance(player, game.HumanPlayer):
+            self.request_computer_move(pressed_column)
+            return
+        column = player.get_move(self.board, pressed_column)
         if column != 0 and not column: # 0 is falsy
             self.canvas.bind("<Button-1>", self.put_one_event)
             LOGGER.debug("Couldn't find column")
             return
+        if column != self.prediction:
+            # pondering the wrong move (or not yet) - free the worker for the real one
+            self.worker.cancel()
+        self.played(player, column)
+
+    def played(self, player, column):
         self.player_indicator.set("%s player plays column %s" % (player.get_color(), str(column)))
         LOGGER.debug("put one event: %s" % str(column))
         self.put_one(column)
@@ -343,6 +471,7 @@ class GameBoard(Tk.Frame):
 
 
 def main():
+    configure_logging()
     root = Tk.Tk()
     show_pre_game_menu(None, root)
     root.mainloop()
@@ -0,0 +1,72 @@
+__author__ = 'reut'
+
+import logging
+import Queue
+import threading
+
+from connect4.logic.AI import SearchTimeout
+
+LOGGER = logging.getLogger("connect4.gui")
+
+
+class AnalysisWorker(threading.Thread):
+    """
+    runs searches off the Tk main loop, one at a time.
+    every request is tagged with the position it analyses, results come back through
+    the results queue (poll it with after()) and are dropped there if the position changed.
+    a task that fails posts ("error", position, exception) instead of its kind and result.
+    cancel() throws away queued requests and stops the running search.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        self.generation = 0
+        self.running = None
+        self.lock = threading.Lock()
+
+    def submit(self, kind, position, strategy, task):
+        """
+        run task() (a search using strategy) and post (kind, position, result) when done
+        """
+        with self.lock:
+            self.requests.put((self.generation, kind, position, strategy, task))
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            if self.running is not None:
+                self.running.stop()
+
+    def shutdown(self):
+        self.cancel()
+        self.requests.put(None)
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                LOGGER.debug("analysis worker stopped")
+                break
+            generation, kind, position, strategy, task = request
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                strategy.stopped = False
+                self.running = strategy
+            try:
+                result = task()
+            except SearchTimeout:
+                LOGGER.debug("%s analysis cancelled", kind)
+                continue
+            except Exception as error:
+                # the thread must outlive a failed task, or no later request is answered
+                LOGGER.exception("%s analysis failed", kind)
+                kind, result = "error", error
+            finally:
+                with self.lock:
+                    self.running = None
+            if generation == self.generation:
+                self.results.put((kind, position, result))
@@ -1,16 +1,15 @@
 # -*- coding: utf8 -*-
-import connect4.logic.game
+from connect4.logic.solver import get_solver_geometry
 import os
+import time
 
 import logging
 
-LOGGER = logging.getLogger("connect4-AI")
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-sh = logging.StreamHandler()
-sh.setFormatter(formatter)
-sh.setLevel(logging.DEBUG)
-LOGGER.addHandler(sh)
-LOGGER.setLevel(logging.WARN)
+LOGGER = logging.getLogger("connect4.AI")
+
+# stand-ins for boards better and worse than any real one, scored by the heuristics
+POSITIVE_BOARD = object()
+NEGATIVE_BOARD = object()
 
 
 class NaiveHeuristic(object):
@@ -40,69 +39,742 @@ class NaiveHeuristic(object):
 """
 
 
+class TranspositionTable(object):
+    """
+    fixed size table of searched positions keyed by the board's zobrist hash.
+    every slot has a depth-preferred entry, replaced only by searches at least as deep,
+    and an always-replace entry that takes whatever the first one refuses.
+    """
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    # rough size of an entry tuple and its contents
+    ENTRY_BYTES = 160
+
+    def __init__(self, megabytes=16):
+        self.size = max(1, megabytes * 1024 * 1024 // (2 * TranspositionTable.ENTRY_BYTES))
+        self.deep = [None] * self.size
+        self.recent = [None] * self.size
+        self.hits = self.misses = self.collisions = 0
+
+    def get(self, key):
+        index = key % self.size
+        entry = self.deep[index]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        other = self.recent[index]
+        if other is not None and other[0] == key:
+            self.hits += 1
+            return other
+        if entry is not None or other is not None:
+            self.collisions += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, depth, bound, score, move):
+        index = key % self.size
+        entry = self.deep[index]
+        if entry is None or entry[0] == key or entry[1] <= depth:
+            self.deep[index] = (key, depth, bound, score, move)
+        else:
+            self.recent[index] = (key, depth, bound, score, move)
+
+    def reset_stats(self):
+        self.hits = self.misses = self.collisions = 0
+
+    def clear(self):
+        self.deep = [None] * self.size
+        self.recent = [None] * self.size
+        self.reset_stats()
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class MoveOrdering(object):
+    """
+    order in which a node's moves are searched - left to right, as valid_moves_iterator yields them.
+    alpha-beta cuts more when the best move comes first.
+    """
+
+    def order(self, board, moves, ply):
+        return moves
+
+    def cutoff(self, board, move, ply, depth):
+        # called with the move that caused a cutoff, while the player who played it is to move
+        pass
+
+    def reset(self):
+        pass
+
+
+class CenterFirstOrdering(MoveOrdering):
+    """
+    middle columns first - they take part in the most winning lines
+    """
+
+    def order(self, board, moves, ply):
+        center = (board.columns - 1) / 2.0
+        return sorted(moves, key=lambda move: abs(move - center))
+
+
+class KillerHistoryOrdering(CenterFirstOrdering):
+    """
+    center first, then moves that caused cutoffs: the last two killer moves of the same ply
+    go first and the rest are sorted by how many (depth weighted) cutoffs each player's column made.
+    """
+
+    def __init__(self):
+        self.killers = {}
+        self.history = {}
+
+    def order(self, board, moves, ply):
+        center = (board.columns - 1) / 2.0
+        killers = self.killers.get(ply, ())
+        history = self.history
+        player = board.current_index
+        return sorted(moves, key=lambda move: (
+            move not in killers, -history.get((player, move), 0), abs(move - center)
+        ))
+
+    def cutoff(self, board, move, ply, depth):
+        killers = self.killers.get(ply, ())
+        if move not in killers:
+            self.killers[ply] = (move,) + killers[:1]
+        key = board.current_index, move
+        self.history[key] = self.history.get(key, 0) + depth * depth
+
+    def reset(self):
+        self.killers = {}
+        self.history = {}
+
+
+# _threat_moves results: nothing forced, a single block to play, a move deciding the game
+FREE = 0
+BLOCK = 1
+DECIDED = 2
+
+
+def _threat_moves(board, winning, moves):
+    """
+    (moves worth searching of the two player board, FREE, BLOCK or DECIDED) with winning the
+    solver's winning_positions: the move winning at once (DECIDED), else the block of the opponent's
+    win (BLOCK, or DECIDED with two wins to block - the block of one loses to the other), else the
+    moves not right below a cell the opponent would win on - all of them if there are none
+    """
+    column_bits = board.column_bits
+    own = board.masks[board.current_index]
+    occupied = own | board.masks[1 - board.current_index]
+    playable = (occupied + board.geometry.bottom) & board.geometry.full
+    forced = winning(own, occupied) & playable
+    kind = DECIDED
+    if not forced:
+        threats = winning(occupied ^ own, occupied)
+        forced = threats & playable
+        if not forced:
+            heights = board.heights
+            safe = [move for move in moves if not threats >> move * column_bits + heights[move] + 1 & 1]
+            return safe or moves, FREE
+        if not forced & (forced - 1):
+            kind = BLOCK
+    return [((forced & -forced).bit_length() - 1) // column_bits], kind
+
+
+class SearchStatistics(object):
+    """
+    counters of one search (or one iterative deepening run), kept by the strategy as statistics
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        # nodes visited at every ply from the root
+        self.nodes_per_ply = []
+        self.cutoffs = 0
+        # nodes with a single forced move (a win or a block)
+        self.forced = 0
+        self.evaluations = 0
+        # nodes whose moves were searched, and how many moves that was
+        self.expanded = 0
+        self.children = 0
+        # (depth, seconds, nodes) of every finished iteration
+        self.iterations = []
+        self.seconds = 0.0
+        self.table_hits = self.table_misses = self.table_collisions = 0
+        # pstats.Stats of the search when the strategy profiles
+        self.profile = None
+
+    @property
+    def branching_factor(self):
+        return float(self.children) / self.expanded if self.expanded else 0.0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+    def merge(self, other, plies=0):
+        # add the counters of a search done elsewhere (a worker's root move), whose root was plies deep
+        self.nodes += other.nodes
+        for ply, nodes in enumerate(other.nodes_per_ply, plies):
+            while len(self.nodes_per_ply) < ply:
+                self.nodes_per_ply.append(0)
+            if ply < len(self.nodes_per_ply):
+                self.nodes_per_ply[ply] += nodes
+            else:
+                self.nodes_per_ply.append(nodes)
+        self.cutoffs += other.cutoffs
+        self.forced += other.forced
+        self.evaluations += other.evaluations
+        self.expanded += other.expanded
+        self.children += other.children
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["profile"] = None
+        return state
+
+    def as_dict(self):
+        return {
+            "nodes": self.nodes,
+            "nodes_per_ply": list(self.nodes_per_ply),
+            "cutoffs": self.cutoffs,
+            "forced": self.forced,
+            "evaluations": self.evaluations,
+            "branching_factor": self.branching_factor,
+            "iterations": list(self.iterations),
+            "seconds": self.seconds,
+            "nodes_per_second": self.nodes_per_second,
+            "table_hits": self.table_hits,
+            "table_misses": self.table_misses,
+            "table_collisions": self.table_collisions,
+        }
+
+
+# best root score found so far by any worker of a parallel search, set by the pool initializer
+_shared_alpha = None
+
+
+def _init_root_worker(shared_alpha):
+    global _shared_alpha
+    _shared_alpha = shared_alpha
+
+
+def _search_root_move(task):
+    """
+    search one root move in a pool worker, inside a window just below the best score so far.
+    returns (score, moves, exact, statistics) - inexact results only prove the move is no better than that score.
+    """
+    board, heuristic, table_megabytes, threats, move, depth = task
+    # a fresh table per move keeps the result independent of which worker got which moves
+    strategy = MinMaxStrategy(heuristic, table_megabytes=table_megabytes, threats=threats)
+    maxplayer = board.current_player
+    # one below the best so far, so a move that ties it still gets an exact score
+    alpha = _shared_alpha.value - 1
+    board.put_one(move, record=False)
+    score, moves = strategy.alphabeta(board, depth, a=(alpha, ()), maxplayer=maxplayer)
+    exact = score > alpha
+    if exact:
+        with _shared_alpha.get_lock():
+            if score > _shared_alpha.value:
+                _shared_alpha.value = score
+    return score, (move,) + moves, exact, strategy.statistics
+
+
 class MinMaxStrategy(object):
-    def __init__(self, heuristic):
+    NEGATIVE = (-9999, ())
+    POSITIVE = (9999, ())
+
+    def __init__(self, heuristic, table_megabytes=16, ordering=None, profile=False,
+                 on_node=None, on_cutoff=None, on_iteration=None, store=None, threats=True):
         self.heuristic = heuristic
+        # two player searches only play the win or the block when a player can win at once
+        self.threats = threats
+        # optional EvaluationStore (see connect4.logic.store) checked before searching from the root
+        self.store = store
+        self.ordering = ordering if ordering is not None else KillerHistoryOrdering()
+        # statistics of the last search
+        self.statistics = SearchStatistics()
+        # run searches under cProfile, the stats go to statistics.profile
+        self.profile = profile
+        # optional hooks: on_node(board, depth), on_cutoff(board, move, ply),
+        # on_iteration(depth, (score, moves), statistics)
+        self.on_node = on_node
+        self.on_cutoff = on_cutoff
+        self.on_iteration = on_iteration
+        # set from another thread to abandon searches (they raise SearchTimeout) until cleared
+        self.stopped = False
+        self.table_megabytes = table_megabytes
+        self.table = TranspositionTable(table_megabytes)
+        self.pool = None
+        self.shared_alpha = None
 
-    def get_move(self, board, startdepth):
-        LOGGER.info("Fetching best move (level: %d)" % startdepth)
-        maxplayer = board.current_player
+    def __getstate__(self):
+        # tables and worker pools stay in their process
+        state = dict(self.__dict__)
+        del state["table"], state["pool"], state["shared_alpha"]
+        return state
 
-        def __abprun(node, depth, a, b):
-            LOGGER.debug("prunning...")
-            if depth == 0 or node.get_winner():
-                return node
-
-            if node.current_player is maxplayer:
-                # maximize
-                v = connect4.logic.game.Board.NEGATIVE_BOARD
-                # LOGGER.debug("Moves: %s" % str(list(node.valid_moves_iterator)))
-                for move in node.valid_moves_iterator:
-                    # LOGGER.info("Selected max move: %d, depth: %d" % (move, depth))
-                    v = max(v, __abprun(node.simulate_move(move), depth - 1, a, b), key=self.heuristic.value)
-                    a = max(a, v, key=self.heuristic.value)
-                    if self.heuristic.value(b) <= self.heuristic.value(a):
-                        # LOGGER.info("Pruned at maximize move %d (value: %d)", move, self.heuristic.value(b))
-                        break
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table = TranspositionTable(self.table_megabytes)
+        self.pool = None
+        self.shared_alpha = None
+
+    @property
+    def nodes(self):
+        # nodes visited by the last search
+        return self.statistics.nodes
+
+    def __start(self):
+        self.statistics = SearchStatistics()
+        self.table.reset_stats()
+        self.ordering.reset()
+        return time.time()
+
+    def __finish(self, started, best):
+        statistics = self.statistics
+        statistics.seconds = time.time() - started
+        statistics.table_hits = self.table.hits
+        statistics.table_misses = self.table.misses
+        statistics.table_collisions = self.table.collisions
+        LOGGER.info("Best moves: %s (score: %d)", best[1], best[0])
+        LOGGER.info("Searched %d nodes in %.3f seconds (%d nodes/sec, %d cutoffs, branching factor %.2f)",
+                    statistics.nodes, statistics.seconds, statistics.nodes_per_second, statistics.cutoffs,
+                    statistics.branching_factor)
+        LOGGER.info("Transposition table: %d hits, %d misses, %d collisions",
+                    self.table.hits, self.table.misses, self.table.collisions)
+
+    def __profiled(self, function, *args):
+        if not self.profile:
+            return function(*args)
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            self.statistics.profile = pstats.Stats(profiler)
+
+    def search(self, board, startdepth, deadline=None):
+        """
+        alpha-beta search that plays and undoes moves on the given board instead of copying it.
+        returns (score, principal variation) where the variation holds the columns played from board.
+        raises SearchTimeout (leaving the board as it was) when time.time() passes the deadline
+        or the strategy is stopped.
+        """
+        LOGGER.info("Searching best move (level: %d)", startdepth)
+        started = self.__start()
+        depth = min(startdepth, len(list(board.valid_moves_iterator)))
+        stored = self.__stored(board, depth)
+        if stored is not None:
+            return stored[1:]
+        best = self.__profiled(self.__search, board, startdepth, deadline)
+        self.__finish(started, best)
+        self.__store(board, depth, best)
+        return best
+
+    def __stored(self, board, depth):
+        # (depth, score, moves) of the store's entry for board, scores are kept for the player to move
+        if self.store is None or self.heuristic.player is not board.current_player:
+            return None
+        return self.store.get(board, self.heuristic, depth)
+
+    def __store(self, board, depth, best):
+        if self.store is not None and self.heuristic.player is board.current_player:
+            self.store.put(board, self.heuristic, depth, best)
 
-                LOGGER.info("max move: %s, %s" % (str([move[2] for move in a.moves]), str(a)))
+    def __winning(self, board):
+        # the solver's winning_positions for board when threats are looked for, else None
+        if self.threats and len(board.players) == 2 and all(player.id != -1 for player in board.players):
+            return get_solver_geometry(board.rows, board.columns, board.goal).winning_positions
+        return None
+
+    def __search(self, board, startdepth, deadline):
+        return self.alphabeta(board, min(startdepth, len(list(board.valid_moves_iterator))), deadline=deadline)
+
+    def alphabeta(self, board, depth, a=NEGATIVE, b=POSITIVE, maxplayer=None, deadline=None):
+        """
+        (score, moves) of board searched to depth within the (a, b) window, maximizing for
+        maxplayer (the player to move by default). moves start at board.
+        positions reached again through another move order are answered from the transposition table,
+        and the best move the table remembers for a position is searched first.
+        in two player games with threats on, a move winning at once or blocking the opponent's win
+        is the only one searched (see _threat_moves), moves deciding the game don't count against
+        depth, and moves right below a cell the opponent would win on are skipped while there are others.
+        """
+        maxplayer = maxplayer or board.current_player
+        value = self.heuristic.value
+        table = self.table
+        ordering = self.ordering
+        statistics = self.statistics
+        nodes_per_ply = statistics.nodes_per_ply
+        on_node = self.on_node
+        on_cutoff = self.on_cutoff
+        last = board.columns - 1
+        line = []
+        winning = self.__winning(board)
+
+        def __abprun(depth, a, b, root=False):
+            # a and b are (score, moves) pairs, moves are taken from the searched board
+            statistics.nodes += 1
+            ply = len(line)
+            if ply < len(nodes_per_ply):
+                nodes_per_ply[ply] += 1
+            else:
+                nodes_per_ply.append(1)
+            if on_node is not None:
+                on_node(board, depth)
+            # before the leaf return, most nodes are leaves
+            if statistics.nodes & 31 == 0 and (self.stopped or deadline is not None and time.time() > deadline):
+                raise SearchTimeout()
+            if depth == 0 or board.get_winner():
+                statistics.evaluations += 1
+                return value(board), tuple(line)
+
+            maximize = board.current_player is maxplayer
+            # mirrored positions share entries, their moves are stored mirrored
+            key = board.hash
+            mirrored = board.mirror_hash < key
+            if mirrored:
+                key = board.mirror_hash
+            entry = table.get(key)
+            table_move = entry[4] if entry is not None else None
+            if mirrored and table_move is not None:
+                table_move = last - table_move
+            if entry is not None and entry[1] >= depth and not root:
+                _, _, bound, score, _ = entry
+                move = table_move
+                found = score, tuple(line) + ((move,) if move is not None else ())
+                if maximize:
+                    if bound == TranspositionTable.UPPER and score <= a[0]:
+                        return a
+                    if bound == TranspositionTable.LOWER and score >= b[0]:
+                        return found
+                    if bound == TranspositionTable.EXACT:
+                        return found if score > a[0] else a
+                else:
+                    if bound == TranspositionTable.LOWER and score >= b[0]:
+                        return b
+                    if bound == TranspositionTable.UPPER and score <= a[0]:
+                        return found
+                    if bound == TranspositionTable.EXACT:
+                        return found if score < b[0] else b
+
+            step = 1
+            moves = list(board.valid_moves_iterator)
+            forced = FREE
+            if winning is not None:
+                moves, forced = _threat_moves(board, winning, moves)
+            if forced:
+                statistics.forced += 1
+                if forced == DECIDED:
+                    # the game ends within two moves, followed to the end without using up depth
+                    step = 0
+            else:
+                moves = ordering.order(board, moves, ply)
+                if table_move in moves:
+                    # best move of an earlier (shallower) search goes first
+                    moves.remove(table_move)
+                    moves.insert(0, table_move)
+                if root and board.hash == board.mirror_hash:
+                    # the mirror image of every move is as good as the move
+                    moves = [move for move in moves if 2 * move <= last]
+
+            statistics.expanded += 1
+            best = None
+            if maximize:
+                alpha = a
+                for move in moves:
+                    statistics.children += 1
+                    board.put_one(move, record=False)
+                    line.append(move)
+                    v = __abprun(depth - step, a, b)
+                    line.pop()
+                    board.undo()
+                    if v[0] > a[0]:
+                        a = v
+                        best = move
+                    if b[0] <= a[0]:
+                        statistics.cutoffs += 1
+                        ordering.cutoff(board, move, ply, depth)
+                        if on_cutoff is not None:
+                            on_cutoff(board, move, ply)
+                        break
+                if mirrored and best is not None:
+                    best = last - best
+                if a[0] <= alpha[0]:
+                    table.put(key, depth, TranspositionTable.UPPER, alpha[0], best)
+                elif a[0] >= b[0]:
+                    table.put(key, depth, TranspositionTable.LOWER, a[0], best)
+                else:
+                    table.put(key, depth, TranspositionTable.EXACT, a[0], best)
                 return a
             # minimize
-            v = connect4.logic.game.Board.POSITIVE_BOARD
-            # LOGGER.debug("Moves: %s" % str(list(node.valid_moves_iterator)))
-            for move in node.valid_moves_iterator:
-                # LOGGER.info("Selected min move: %d, depth: %d" % (move, depth))
-                v = min(v, __abprun(node.simulate_move(move), depth - 1, a, b), key=self.heuristic.value)
-                b = min(b, v, key=self.heuristic.value)
-                if self.heuristic.value(b) <= self.heuristic.value(a):
-                    # LOGGER.info("Pruned at minimize move %d (value: %d)", move, self.heuristic.value(b))
+            beta = b
+            for move in moves:
+                statistics.children += 1
+                board.put_one(move, record=False)
+                line.append(move)
+                v = __abprun(depth - step, a, b)
+                line.pop()
+                board.undo()
+                if v[0] < b[0]:
+                    b = v
+                    best = move
+                if b[0] <= a[0]:
+                    statistics.cutoffs += 1
+                    ordering.cutoff(board, move, ply, depth)
+                    if on_cutoff is not None:
+                        on_cutoff(board, move, ply)
                     break
-            LOGGER.info("min move: %s, %s" % (str([move[2] for move in b.moves]), str(b)))
+            if mirrored and best is not None:
+                best = last - best
+            if b[0] >= beta[0]:
+                table.put(key, depth, TranspositionTable.LOWER, beta[0], best)
+            elif b[0] <= a[0]:
+                table.put(key, depth, TranspositionTable.UPPER, b[0], best)
+            else:
+                table.put(key, depth, TranspositionTable.EXACT, b[0], best)
             return b
-        best = __abprun(board, min(startdepth, len(list(board.valid_moves_iterator))), connect4.logic.game.Board.NEGATIVE_BOARD,
-                        connect4.logic.game.Board.POSITIVE_BOARD)
-        LOGGER.info("Best move: %s (score: %d)" % (str(best), self.heuristic.value(best)))
-        LOGGER.info("moves: %s)" % str(tuple(x[2] for x in best.moves)))
+
+        played = len(board.moves)
+        try:
+            return __abprun(depth, a, b, root=True)
+        except SearchTimeout:
+            while len(board.moves) > played:
+                board.undo()
+            raise
+
+    def search_timed(self, board, milliseconds, maxdepth=None):
+        """
+        iterative deepening: searches depth 1, 2, 3... until the time budget runs out and
+        returns (score, principal variation) of the deepest finished iteration.
+        every iteration leaves its best moves in the table, ordering the next one.
+        """
+        started = self.__start()
+        best = self.__profiled(self.__search_timed, board, milliseconds, maxdepth)
+        self.__finish(started, best)
+        if self.statistics.iterations:
+            self.__store(board, self.statistics.iterations[-1][0], best)
+        return best
+
+    def __search_timed(self, board, milliseconds, maxdepth):
+        deadline = time.time() + milliseconds / 1000.0
+        # search caps its depth at the number of playable columns, deeper iterations would repeat it
+        deepest = min(board.rows * board.columns - sum(board.heights), len(list(board.valid_moves_iterator)))
+        maxdepth = deepest if maxdepth is None else min(maxdepth, deepest)
+        best = None
+        first = 1
+        stored = self.__stored(board, 1)
+        if stored is not None:
+            # continue deeper than the stored result, its move goes first
+            depth, score, moves = stored
+            best = score, moves
+            first = depth + 1
+            key = board.canonical_key()
+            move = moves[0] if key == board.hash else board.mirror_column(moves[0])
+            self.table.put(key, depth, TranspositionTable.EXACT, score, move)
+        for depth in xrange(first, maxdepth + 1):
+            iteration = time.time()
+            try:
+                # the first iteration always finishes so there is a move to return
+                best = self.__search(board, depth, deadline if best is not None else None)
+            except SearchTimeout:
+                break
+            self.statistics.iterations.append((depth, time.time() - iteration, self.statistics.nodes))
+            if self.on_iteration is not None:
+                self.on_iteration(depth, best, self.statistics)
+        LOGGER.info("Deepest finished iteration: %d (score: %d)",
+                    self.statistics.iterations[-1][0] if self.statistics.iterations else first - 1, best[0])
+        return best
+
+    def search_parallel(self, board, startdepth, processes=None):
+        """
+        root-parallel search over a pool of processes: the first root move is searched here
+        (young brothers wait) to get a bound, then the rest are split between the workers,
+        which share the best score found so far as their alpha.
+        the chosen move and score are the ones search would return with the same ordering.
+        """
+        depth = min(startdepth, len(list(board.valid_moves_iterator)))
+        winning = self.__winning(board)
+        if depth < 2 or winning is not None and _threat_moves(board, winning, [])[1] != FREE:
+            # a forced move is all there is to search
+            return self.search(board, startdepth)
+        LOGGER.info("Searching best move in parallel (level: %d)", startdepth)
+        stored = self.__stored(board, depth)
+        if stored is not None:
+            return stored[1:]
+        if self.pool is None:
+            import multiprocessing
+            self.shared_alpha = multiprocessing.Value("i", MinMaxStrategy.NEGATIVE[0])
+            self.pool = multiprocessing.Pool(processes, _init_root_worker, (self.shared_alpha,))
+        started = self.__start()
+        best = self.__profiled(self.__search_parallel, board, depth)
+        self.__finish(started, best)
+        self.__store(board, depth, best)
+        return best
+
+    def __search_parallel(self, board, depth):
+        moves = list(board.valid_moves_iterator)
+        winning = self.__winning(board)
+        if winning is not None:
+            moves = _threat_moves(board, winning, moves)[0]
+        moves = self.ordering.order(board, moves, 0)
+        key = board.canonical_key()
+        entry = self.table.get(key)
+        if entry is not None and entry[4] is not None:
+            move = entry[4] if key == board.hash else board.mirror_column(entry[4])
+            if move in moves:
+                moves.remove(move)
+                moves.insert(0, move)
+        if board.is_symmetric():
+            moves = [move for move in moves if move <= board.mirror_column(move)]
+
+        # the root is counted here like search counts it, its subtrees one ply below it
+        statistics = self.statistics
+        statistics.nodes += 1
+        if not statistics.nodes_per_ply:
+            statistics.nodes_per_ply.append(0)
+        statistics.nodes_per_ply[0] += 1
+        statistics.expanded += 1
+        statistics.children += len(moves)
+
+        eldest = moves[0]
+        maxplayer = board.current_player
+        board.put_one(eldest, record=False)
+        # alphabeta counts into self.statistics from ply 0
+        self.statistics = SearchStatistics()
+        try:
+            score, line = self.alphabeta(board, depth - 1, maxplayer=maxplayer)
+        finally:
+            board.undo()
+            statistics.merge(self.statistics, 1)
+            self.statistics = statistics
+        best = score, (eldest,) + line
+        self.shared_alpha.value = score
+
+        results = self.pool.map(
+            _search_root_move,
+            [(board, self.heuristic, self.table_megabytes, self.threats, move, depth - 1) for move in moves[1:]],
+            chunksize=1
+        )
+        # root moves in search order, the first of the highest exact scores wins like in search
+        for score, line, exact, subtree in results:
+            statistics.merge(subtree, 1)
+            if exact and score > best[0]:
+                best = score, line
+        move = best[1][0] if key == board.hash else board.mirror_column(best[1][0])
+        self.table.put(key, depth, TranspositionTable.EXACT, best[0], move)
+        return best
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def get_move(self, board, startdepth):
+        # the board reached by following the principal variation
+        score, moves = self.search(board, startdepth)
+        best = board.copy(moves[0])
+        for move in moves[1:]:
+            best.put_one(move)
         return best
 
 
 def nruns_with_owners(board):
-    for nrun in board.nrun_iterator:
-        nrun = list(nrun)
-        players_on_nrun = tuple(board.get_piece(*location).owner for location in nrun if board.get_piece(*location) is not None)
-        # LOGGER.debug("players on nrun: %s" % str(players_on_nrun))
-        owners = set(players_on_nrun)
+    players = zip(board.players, board.masks)
+    for nrun, line_mask in zip(board.geometry.lines, board.geometry.line_masks):
+        owners = set(player for player, mask in players if mask & line_mask)
         yield nrun, owners
 
 
+class AvailableVictoriesScores(object):
+    """
+    running AvailableVictoriesHeuristic score of every player on a board.
+    keeps how many pieces each player has on every line, so a move only
+    rescores the lines through its cell.
+    """
+    MIXED = -1
+
+    def __init__(self, geometry, players):
+        self.cell_lines = geometry.cell_lines
+        lines = len(geometry.lines)
+        self.counts = [[0] * lines for _ in xrange(players)]
+        self.taken = [0] * lines
+        # None - empty line, player index - single owner, MIXED - ruined
+        self.owners = [None] * lines
+        # every line starts available (-1 each)
+        self.scores = [-lines] * players
+        self.twos = tuple(2 ** k for k in xrange(geometry.goal + 1))
+        self.threes = tuple(3 ** k for k in xrange(geometry.goal + 1))
+
+    def __line_value(self, owner, taken, player):
+        if owner is None:
+            # available - we want it taken so -1
+            return -1
+        if owner == AvailableVictoriesScores.MIXED:
+            # ruined...
+            return 0
+        # bias towards ruining other player's runs
+        if owner == player:
+            return self.twos[taken]
+        return -self.threes[taken]
+
+    def __rescore(self, line, owner, taken):
+        old_owner, old_taken = self.owners[line], self.taken[line]
+        self.owners[line] = owner
+        self.taken[line] = taken
+        if old_owner == owner == AvailableVictoriesScores.MIXED:
+            return
+        scores = self.scores
+        for player in xrange(len(scores)):
+            scores[player] += self.__line_value(owner, taken, player) - self.__line_value(old_owner, old_taken, player)
+
+    def put(self, player, position):
+        for line in self.cell_lines[position]:
+            self.counts[player][line] += 1
+            owner = self.owners[line]
+            if owner is not None and owner != player:
+                owner = AvailableVictoriesScores.MIXED
+            self.__rescore(line, player if owner is None else owner, self.taken[line] + 1)
+
+    def undo(self, player, position):
+        for line in self.cell_lines[position]:
+            self.counts[player][line] -= 1
+            taken = self.taken[line] - 1
+            owner = self.owners[line]
+            if taken == 0:
+                owner = None
+            elif owner == AvailableVictoriesScores.MIXED:
+                owners = [index for index, counts in enumerate(self.counts) if counts[line]]
+                if len(owners) == 1:
+                    owner = owners[0]
+            self.__rescore(line, owner, taken)
+
+    def copy(self):
+        scores = AvailableVictoriesScores.__new__(AvailableVictoriesScores)
+        scores.cell_lines = self.cell_lines
+        scores.counts = [list(counts) for counts in self.counts]
+        scores.taken = list(self.taken)
+        scores.owners = list(self.owners)
+        scores.scores = list(self.scores)
+        scores.twos = self.twos
+        scores.threes = self.threes
+        return scores
+
+
 class AvailableVictoriesHeuristic(object):
     def __init__(self, player):
         self.player = player
 
     def value(self, board):
-        if board is connect4.logic.game.Board.POSITIVE_BOARD:
+        if board is POSITIVE_BOARD:
             return 9999
-        if board is connect4.logic.game.Board.NEGATIVE_BOARD:
+        if board is NEGATIVE_BOARD:
             return -9999
         winner = board.get_winner()
         if winner:
@@ -111,34 +783,5 @@ class AvailableVictoriesHeuristic(object):
             return -9998
 
         # TODO: scale with run length and strength (already taken pieces)
-
-        def __value(run, owners):
-            if len(owners) == 0:
-                # available - we want it taken so -1
-                return -1
-
-            if len(owners) == 1:
-                _owner = next(iter(owners))
-                # bias towards ruining other player's runs
-                taken_count = 0
-                for x, y in run:
-                    piece = board.get_piece(x, y)
-                    if piece and piece.owner == _owner:
-                        taken_count += 1
-
-                if _owner == self.player:
-                    return 2 ** taken_count
-                return -(3 ** taken_count)
-
-            if len(owners) > 1:
-                # ruined...
-                return 0
-
-        score = 0
-        for nrun_with_owners in nruns_with_owners(board):
-            nrun = list(nrun_with_owners[0])
-            v = __value(nrun, nrun_with_owners[1])
-            # LOGGER.debug("nrun: %s, owners: %s, score: %s" % ([board.get_piece(x, y) for x, y in nrun], [owner.id for owner in nrun_with_owners[1]], v))
-            score += v
-        # LOGGER.debug("Value: %d", score)
-        return score
+        # the board keeps every player's score up to date as pieces are put and removed
+        return board.victories.scores[board.players.index(self.player)]
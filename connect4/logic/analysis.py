@@ -0,0 +1,201 @@
+"""
+bulk position analysis: best move, score, principal variation and nodes of every position of
+many games, searched on a process pool and streamed back as they finish.
+
+    for annotation in analyze(games, depth=6, processes=8):
+        ...
+
+    connect4-analyze games.jsonl --depth 8 --output annotations.jsonl
+
+games are sequences of columns played from the first player, or dicts like the tournament
+writes ({"first": "a" or "b", "opening": [...], "moves": [...]}); Boards are analysed as single positions.
+at most in_flight positions are queued or being searched at any time, so the input is read
+only as fast as the workers take it.
+"""
+__author__ = 'reut'
+
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+
+from connect4 import configure_logging
+from connect4.logic.store import EvaluationStore
+
+LOGGER = logging.getLogger("connect4.analysis")
+
+# board, strategies and settings of this process, made once per worker by _init_worker
+_board = None
+_strategies = None
+_settings = None
+
+
+def _init_worker(settings):
+    global _board, _strategies, _settings
+    from connect4.logic import game, AI
+    players = game.make_players(lambda index: game.HumanPlayer("analysis %d" % index), settings["players"])
+    _board = game.Board(players, settings["rows"], settings["columns"], settings["goal"])
+    heuristic_class = getattr(AI, settings["heuristic"])
+    _strategies = [
+        game.MinMaxStrategy(heuristic_class(player), settings["table_megabytes"], store=settings["store"])
+        for player in players
+    ]
+    _settings = settings
+
+
+def _analyze_position(task):
+    # annotation of the position reached by playing moves from the first player
+    item, first, moves = task
+    while _board.moves:
+        _board.undo()
+    _board.set_current_index(first)
+    for move in moves:
+        _board.put_one(move, record=False)
+    strategy = _strategies[_board.current_index]
+    # whichever worker gets a position, it is searched from the same (empty) table
+    strategy.table.clear()
+    start = time.time()
+    if _settings["move_time"]:
+        score, line = strategy.search_timed(_board, _settings["move_time"], _settings["depth"])
+    else:
+        score, line = strategy.search(_board, _settings["depth"])
+    return {
+        "item": item,
+        "ply": len(moves),
+        "moves": list(moves),
+        "best": line[0],
+        "score": score,
+        "pv": list(line),
+        "nodes": strategy.nodes,
+        "seconds": time.time() - start,
+    }
+
+
+def game_positions(item, game, geometry):
+    """
+    (item, first player index, moves) of every position of a game that has a move to play.
+    a game stops at its first won or full position, and at a move into a full column
+    """
+    if hasattr(game, "masks"):
+        # a Board: only its current position
+        if (game.rows, game.columns, game.goal, len(game.players)) != geometry:
+            raise ValueError("board %d is not a %dx%d goal %d board of %d players" % ((item,) + geometry))
+        first = (game.current_index - len(game.moves)) % len(game.players)
+        if not game.get_winner():
+            yield item, first, tuple(column for _, _, column in game.moves)
+        return
+    if isinstance(game, dict):
+        first = "ab".index(game.get("first", "a"))
+        columns = list(game.get("opening", ())) + list(game["moves"])
+    else:
+        first = 0
+        columns = list(game)
+    from connect4.logic.game import Board, HumanPlayer, LocationTakenError, make_players
+    board = Board(make_players(lambda index: HumanPlayer("analysis %d" % index), geometry[3]), *geometry[:3])
+    board.set_current_index(first)
+    for ply, column in enumerate(columns):
+        yield item, first, tuple(columns[:ply])
+        try:
+            board.put_one(column, record=False)
+        except LocationTakenError:
+            LOGGER.warn("Game %d plays into the full column %d at ply %d", item, column, ply)
+            return
+        # the last position of a finished game has nothing to play
+        if board.get_winner():
+            if ply + 1 < len(columns):
+                LOGGER.warn("Game %d goes on after it ended at ply %d", item, ply + 1)
+            return
+
+
+def _bounded(tasks, slots, stopped):
+    # tasks, one more only after a slot is released - the pool's feeder thread waits here
+    for task in tasks:
+        slots.acquire()
+        if stopped.is_set():
+            return
+        yield task
+
+
+def analyze(games, depth=6, rows=6, columns=7, goal=4, players=2, processes=None, in_flight=None,
+            heuristic="AvailableVictoriesHeuristic", move_time=None, table_megabytes=16, store=None):
+    """
+    generator of annotations (dicts of item - the game's index in games -, ply, moves, best,
+    score for the player to move, pv, nodes and seconds) of every position of games,
+    in the order they finish.
+    move_time (milliseconds) searches iteratively deeper up to depth instead of to depth.
+    store is an optional EvaluationStore shared by the workers.
+    """
+    settings = {
+        "rows": rows, "columns": columns, "goal": goal, "players": players, "depth": depth,
+        "heuristic": heuristic, "move_time": move_time, "table_megabytes": table_megabytes, "store": store,
+    }
+    geometry = (rows, columns, goal, players)
+    tasks = (task for item, game in enumerate(games) for task in game_positions(item, game, geometry))
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        _init_worker(settings)
+        for task in tasks:
+            yield _analyze_position(task)
+        return
+
+    slots = threading.Semaphore(in_flight or processes * 4)
+    stopped = threading.Event()
+    pool = multiprocessing.Pool(processes, _init_worker, (settings,))
+    try:
+        for annotation in pool.imap_unordered(_analyze_position, _bounded(tasks, slots, stopped)):
+            slots.release()
+            yield annotation
+    finally:
+        # wake the feeder thread if it waits for a slot, the pool can't stop before it does
+        stopped.set()
+        slots.release()
+        pool.terminate()
+
+
+def read_games(lines):
+    # json games, one per line, skipping blank lines
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def main(argv=None):
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Annotate connect 4 games with the engine's analysis.")
+    parser.add_argument("games", nargs="?", help="json lines file of games (stdin by default)")
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--columns", type=int, default=7)
+    parser.add_argument("--goal", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--move-time", type=int, default=None,
+                        help="milliseconds per position (iterative deepening up to --depth)")
+    parser.add_argument("--heuristic", default="AvailableVictoriesHeuristic")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--in-flight", type=int, default=None, help="positions queued at most (4 per process)")
+    parser.add_argument("--store", help="sqlite evaluation store shared by the workers and kept between runs")
+    parser.add_argument("--output", help="json lines file for the annotations (stdout by default)")
+    args = parser.parse_args(argv)
+
+    store = None
+    if args.store:
+        store = EvaluationStore(args.store)
+    source = open(args.games) if args.games else sys.stdin
+    output = open(args.output, "w") if args.output else sys.stdout
+    start = time.time()
+    count = 0
+    try:
+        for annotation in analyze(read_games(source), args.depth, args.rows, args.columns, args.goal,
+                                  processes=args.processes, in_flight=args.in_flight, heuristic=args.heuristic,
+                                  move_time=args.move_time, store=store):
+            output.write(json.dumps(annotation) + "\n")
+            count += 1
+    finally:
+        if args.games:
+            source.close()
+        if args.output:
+            output.close()
+    sys.stderr.write("%d positions analysed in %.1f seconds\n" % (count, time.time() - start))
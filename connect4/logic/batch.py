@@ -0,0 +1,107 @@
+"""
+numpy scoring of many positions at once, for offline analysis of large position sets.
+
+positions are int8 arrays shaped (batch, rows, columns) holding 0 for an empty cell
+and the owner's index in board.players plus one for a taken cell.
+"""
+__author__ = 'reut'
+
+from connect4.logic.geometry import get_geometry
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_LINE_INDEXES = {}
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("batch evaluation needs numpy (pip install numpy)")
+
+
+def line_indexes(rows, columns, goal):
+    """
+    (lines, goal) matrix of flat cell indexes (row * columns + col) of every winning line
+    """
+    _require_numpy()
+    geometry = (rows, columns, goal)
+    if geometry not in _LINE_INDEXES:
+        lines = get_geometry(rows, columns, goal).lines
+        indexes = numpy.array([[row * columns + col for row, col in line] for line in lines], dtype=numpy.intp)
+        _LINE_INDEXES[geometry] = indexes.reshape(len(lines), goal)
+    return _LINE_INDEXES[geometry]
+
+
+def board_array(board):
+    """
+    (rows, columns) int8 array of a board, read from its bitboards one piece at a time
+    """
+    _require_numpy()
+    cells = numpy.zeros((board.rows, board.columns), dtype=numpy.int8)
+    column_bits = board.column_bits
+    for index, mask in enumerate(board.masks):
+        while mask:
+            low = mask & -mask
+            position = low.bit_length() - 1
+            cells[board.rows - 1 - position % column_bits, position // column_bits] = index + 1
+            mask ^= low
+    return cells
+
+
+def positions_array(boards):
+    """
+    stack boards of one geometry into a (batch, rows, columns) int8 array
+    """
+    _require_numpy()
+    return numpy.array([board_array(board) for board in boards], dtype=numpy.int8)
+
+
+def available_victories(positions, goal, player, players):
+    """
+    AvailableVictoriesHeuristic value of every position for the player with the given index.
+    won and full positions score 9998 when the player won and -9998 otherwise, like the heuristic.
+    """
+    _require_numpy()
+    positions = numpy.asarray(positions, dtype=numpy.int8)
+    batch, rows, columns = positions.shape
+    # (batch, lines, goal) owners of every cell of every line
+    cells = positions.reshape(batch, rows * columns)[:, line_indexes(rows, columns, goal)]
+    # (players, batch, lines) pieces each player has on each line
+    counts = numpy.array([(cells == index + 1).sum(axis=2) for index in xrange(players)], dtype=numpy.int64)
+    owners = (counts > 0).sum(axis=0)
+    taken = counts.sum(axis=0)
+    owner = counts.argmax(axis=0)
+
+    single = owners == 1
+    values = numpy.where(owners == 0, -1, 0)
+    values = numpy.where(single & (owner == player), 2 ** taken, values)
+    values = numpy.where(single & (owner != player), -(3 ** taken), values)
+    scores = values.sum(axis=1)
+
+    won = single & (taken == goal)
+    winners = numpy.full(batch, -1, dtype=numpy.int64)
+    if won.shape[1]:
+        winners = numpy.where(won.any(axis=1), owner[numpy.arange(batch), won.argmax(axis=1)], -1)
+    full = (positions != 0).reshape(batch, rows * columns).all(axis=1)
+    scores = numpy.where(winners == player, 9998, numpy.where((winners >= 0) | full, -9998, scores))
+    return scores
+
+
+class AvailableVictoriesBatchHeuristic(object):
+    """
+    AvailableVictoriesHeuristic for many boards of the same geometry in one call
+    """
+
+    def __init__(self, player):
+        self.player = player
+
+    def values(self, boards):
+        boards = list(boards)
+        if not boards:
+            return []
+        first = boards[0]
+        return available_victories(
+            positions_array(boards), first.goal, first.players.index(self.player), len(first.players)
+        ).tolist()
@@ -0,0 +1,235 @@
+"""
+opening books: the best move of every position of the first plies of a geometry, found offline
+by deep searches and stored in a sorted binary file that is read through mmap.
+
+    connect4-book --rows 6 --columns 7 --goal 4 --plies 4 --depth 8
+
+file layout (little endian): a header of magic, version, rows, columns, goal, players and
+record count, then (position hash, move, score) records sorted by hash.
+positions are keyed by Board.canonical_key, so a position and its mirror image share a record
+(moves are stored for the position whose hash is the key).
+scores are the searching heuristic's value for the player to move.
+"""
+__author__ = 'reut'
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+from connect4 import configure_logging
+
+LOGGER = logging.getLogger("connect4.book")
+
+MAGIC = "C4BK"
+VERSION = 2
+HEADER = struct.Struct("<4sBBBBBI")
+RECORD = struct.Struct("<QBh")
+KEY = struct.Struct("<Q")
+
+# books shipped with the package, one file per geometry and number of players
+BOOKS_DIRECTORY = os.environ.get("CONNECT4_BOOKS", os.path.join(os.path.dirname(__file__), "books"))
+
+_BOOKS = {}
+
+
+class BookFormatError(Exception):
+    pass
+
+
+def book_name(rows, columns, goal, players):
+    return "%dx%d-goal%d-%dp.book" % (rows, columns, goal, players)
+
+
+class OpeningBook(object):
+    """
+    read only view of a book file. records are searched in place, the file is never loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise BookFormatError("%s is too short for a book" % path)
+        magic, version, self.rows, self.columns, self.goal, self.players, self.count = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION or len(self.data) != HEADER.size + self.count * RECORD.size:
+            self.close()
+            raise BookFormatError("%s is not a version %d book" % (path, VERSION))
+
+    def __len__(self):
+        return self.count
+
+    def matches(self, board):
+        return (board.rows, board.columns, board.goal, len(board.players)) == \
+               (self.rows, self.columns, self.goal, self.players)
+
+    def lookup(self, board):
+        """
+        (move, score) of board's position, None when the book doesn't have it
+        """
+        if not self.matches(board):
+            return None
+        key = board.canonical_key()
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found, = KEY.unpack_from(data, HEADER.size + middle * RECORD.size)
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                _, move, score = RECORD.unpack_from(data, HEADER.size + middle * RECORD.size)
+                if key != board.hash:
+                    move = board.mirror_column(move)
+                # a (very unlikely) hash collision could name a full column
+                if board.heights[move] < board.rows:
+                    return move, score
+                return None
+        return None
+
+    def close(self):
+        if getattr(self, "data", None) is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+
+def get_book(rows, columns, goal, players):
+    """
+    the book of a geometry from BOOKS_DIRECTORY, loaded once per process. None if there is none.
+    """
+    geometry = (rows, columns, goal, players)
+    if geometry not in _BOOKS:
+        path = os.path.join(BOOKS_DIRECTORY, book_name(rows, columns, goal, players))
+        book = None
+        if os.path.exists(path):
+            try:
+                book = OpeningBook(path)
+            except (BookFormatError, EnvironmentError) as error:
+                LOGGER.warn("Ignoring opening book %s: %s", path, error)
+        _BOOKS[geometry] = book
+    return _BOOKS[geometry]
+
+
+def write_book(path, rows, columns, goal, players, entries):
+    """
+    write entries ({position hash: (move, score)}) as a book file
+    """
+    with open(path, "wb") as output:
+        output.write(HEADER.pack(MAGIC, VERSION, rows, columns, goal, players, len(entries)))
+        for key in sorted(entries):
+            move, score = entries[key]
+            output.write(RECORD.pack(key, move, max(-32768, min(32767, score))))
+
+
+# the board and strategies searching the positions of this process, and the book's settings
+_board = None
+_strategies = None
+_settings = None
+
+
+def _init_worker(settings):
+    global _board, _strategies, _settings
+    # game imports this module, so it is imported when needed
+    from connect4.logic import game
+    players = game.make_players(lambda index: game.HumanPlayer("book %d" % index), settings["players"])
+    _board = game.Board(players, settings["rows"], settings["columns"], settings["goal"])
+    _strategies = [
+        game.MinMaxStrategy(game.AvailableVictoriesHeuristic(player), settings["table_megabytes"])
+        for player in players
+    ]
+    _settings = settings
+
+
+def _search_position(position):
+    # (canonical key, (move, score)) of the position reached by playing moves from the starting player
+    start, moves = position
+    while _board.moves:
+        _board.undo()
+    _board.set_current_index(start)
+    for move in moves:
+        _board.put_one(move, record=False)
+    score, line = _strategies[_board.current_index].search(_board, _settings["depth"])
+    key = _board.canonical_key()
+    return key, (line[0] if key == _board.hash else _board.mirror_column(line[0]), score)
+
+
+def positions(rows, columns, goal, players, plies):
+    """
+    (starting player index, moves) of every position with fewer than plies moves played,
+    one per distinct canonical key, skipping won and full positions
+    """
+    from connect4.logic import game
+    board = game.Board(game.make_players(lambda index: game.HumanPlayer("book %d" % index), players),
+                       rows, columns, goal)
+    seen = set()
+    found = []
+
+    def visit(start, moves):
+        if board.canonical_key() in seen or board.get_winner():
+            return
+        seen.add(board.canonical_key())
+        found.append((start, moves))
+        if len(moves) + 1 < plies:
+            for move in list(board.valid_moves_iterator):
+                board.put_one(move, record=False)
+                visit(start, moves + (move,))
+                board.undo()
+
+    for start in xrange(players):
+        board.set_current_index(start)
+        visit(start, ())
+    return found
+
+
+def generate(rows, columns, goal, plies, depth, players=2, processes=1, table_megabytes=64):
+    """
+    {position hash: (move, score)} of every position of the first plies, searched to depth
+    """
+    settings = {
+        "rows": rows, "columns": columns, "goal": goal, "players": players,
+        "depth": depth, "table_megabytes": table_megabytes,
+    }
+    todo = positions(rows, columns, goal, players, plies)
+    LOGGER.info("Searching %d positions to depth %d", len(todo), depth)
+    if processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, _init_worker, (settings,))
+        try:
+            return dict(pool.map(_search_position, todo, chunksize=8))
+        finally:
+            pool.terminate()
+    _init_worker(settings)
+    return dict(_search_position(position) for position in todo)
+
+
+def main(argv=None):
+    # argparse and multiprocessing are left to the command line, importing books stays light
+    import argparse
+    import multiprocessing
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Generate a connect 4 opening book.")
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--columns", type=int, default=7)
+    parser.add_argument("--goal", type=int, default=4)
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--plies", type=int, default=4, help="book positions with fewer moves played than this")
+    parser.add_argument("--depth", type=int, default=8, help="search depth of every book position")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", help="book file (the package's books directory by default)")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.join(BOOKS_DIRECTORY, book_name(args.rows, args.columns, args.goal, args.players))
+    start = time.time()
+    entries = generate(args.rows, args.columns, args.goal, args.plies, args.depth, args.players, args.processes)
+    write_book(output, args.rows, args.columns, args.goal, args.players, entries)
+    print "%d positions written to %s in %.1f seconds" % (len(entries), output, time.time() - start)
@@ -1,22 +1,31 @@
-from random import choice
+from random import choice, Random
 import os
 import logging
-from AI import MinMaxStrategy, AvailableVictoriesHeuristic
+from connect4.logic.AI import MinMaxStrategy, AvailableVictoriesHeuristic, AvailableVictoriesScores, \
+    SearchStatistics, POSITIVE_BOARD, NEGATIVE_BOARD
+from connect4.logic.geometry import get_geometry
+from connect4.logic.book import get_book
+from connect4.utils.tree import GameRecord
 
-LOGGER = logging.getLogger("connect4-logic")
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-sh = logging.StreamHandler()
-sh.setFormatter(formatter)
-sh.setLevel(logging.DEBUG)
-LOGGER.addHandler(sh)
-LOGGER.setLevel(logging.WARN)
+LOGGER = logging.getLogger("connect4.logic")
 
 
-def make_directions(rows, columns, goal):
-    return ((0, 1, xrange(rows), xrange(columns - goal)),
-            (1, 0, xrange(rows - goal), xrange(columns)),
-            (1, 1, xrange(rows - goal), xrange(columns - goal)),
-            (-1, 1, xrange(goal, rows), xrange(columns - goal)))
+_ZOBRIST_KEYS = {}
+
+
+def zobrist_keys(rows, columns, players):
+    """
+    random 64 bit keys for every (player, bitboard position) and for every player to move.
+    keys are seeded by the geometry so every process hashes a position the same way.
+    """
+    geometry = (rows, columns, players)
+    if geometry not in _ZOBRIST_KEYS:
+        rng = Random(rows * 10000 + columns * 100 + players)
+        positions = columns * (rows + 1)
+        pieces = tuple(tuple(rng.getrandbits(64) for _ in xrange(positions)) for _ in xrange(players))
+        turns = tuple(rng.getrandbits(64) for _ in xrange(players))
+        _ZOBRIST_KEYS[geometry] = pieces, turns
+    return _ZOBRIST_KEYS[geometry]
 
 
 class Game(object):
@@ -42,92 +51,87 @@ class BoardWonError(Exception):
     pass
 
 
+class NoMovesUndoneError(Exception):
+    pass
+
+
 class Board(object):
-    NEGATIVE_BOARD = object()
-    POSITIVE_BOARD = object()
+    NEGATIVE_BOARD = NEGATIVE_BOARD
+    POSITIVE_BOARD = POSITIVE_BOARD
 
     def __init__(self, players, rows=6, columns=7, goal=24, tipheuristic=AvailableVictoriesHeuristic,
                  moves=()):
-        self.moves = moves
+        # the moves played and the variations undone
+        self.history = GameRecord(moves)
+        # (player to move after it, row, column) of every move played, the history's own list
+        self.moves = self.history.moves
         self.rows = rows
         self.columns = columns
         self.goal = goal
-        # tip's column
-        self.tip_strategy = lambda player: MinMaxStrategy(tipheuristic(player)).get_move(self, 4)
-        self.board = [tuple(None for _ in range(columns)) for _ in range(rows)]
+        self.tipheuristic = tipheuristic
+        # tip's (score, moves)
+        self.tip_strategy = lambda player: MinMaxStrategy(tipheuristic(player)).search(self, 4)
+
+        # bitboard: one mask per player laid out by the shared geometry, plus column heights.
+        # python ints are unbounded, so any board size fits in a single mask.
+        self.geometry = get_geometry(rows, columns, goal)
+        self.column_bits = self.geometry.column_bits
+        self.masks = [0] * len(players)
+        self.heights = [0] * columns
+        self.victories = AvailableVictoriesScores(self.geometry, len(players))
+        # only the last move can win, so the winner is found in put_one and cleared by undo
+        self.winner = False
+
+        # zobrist hash of the pieces and the player to move, updated on every move,
+        # and the hash of the board's left-right mirror image
+        self.piece_keys, self.turn_keys = zobrist_keys(rows, columns, len(players))
+        self.current_index = 0
+        self.hash = self.turn_keys[0]
+        self.mirror_hash = self.hash
 
         self.players = players
         self.current_player = choice(self.players)
 
-        self.directions = make_directions(self.rows, self.columns, self.goal)
+    @property
+    def current_player(self):
+        return self.players[self.current_index]
+
+    @current_player.setter
+    def current_player(self, player):
+        self.set_current_index(self.players.index(player))
+
+    def set_current_index(self, index):
+        turn = self.turn_keys[self.current_index] ^ self.turn_keys[index]
+        self.hash ^= turn
+        self.mirror_hash ^= turn
+        self.current_index = index
+
+    def bit(self, row, col):
+        return 1 << self.geometry.position(row, col)
 
     def is_full(self):
-        for row in range(self.rows):
-            for col in range(self.columns):
-                if self.board[row][col] is None:
-                    return False
+        rows = self.rows
+        for height in self.heights:
+            if height < rows:
+                return False
         return True
 
     def get_size(self):
         return self.rows, self.columns
 
-    def __win_from_location_with_direction(self, row, col, player, left, direction):
-
-        if left == 0:
-            return True
-
-        if not 0 <= row < self.rows:
-            return False
-
-        if not 0 <= col < self.columns:
-            return False
-
-        piece = self.board[row][col]
-        if not piece:
-            return False
-        new_row = row + direction[0]
-        new_col = col + direction[1]
-        return piece.owner == player and self.__win_from_location_with_direction(
-            new_row, new_col, player, left - 1, direction
-        )
-
-    def __win_by_row_from_location(self, row, col, player, left):
-        return self.__win_from_location_with_direction(row, col, player, left, (1, 0))
-
-    def __win_by_col_from_location(self, row, col, player, left):
-        return self.__win_from_location_with_direction(row, col, player, left, (0, 1))
-
-    def __win_by_diagonal_left_down_from_location(self, row, col, player, left):
-        return self.__win_from_location_with_direction(row, col, player, left, (1, 1))
-
-    def __win_by_diagonal_left_up_from_location(self, row, col, player, left):
-        return self.__win_from_location_with_direction(row, col, player, left, (1, -1))
-
-    def __win_from_location(self, row, col, player, left):
-        return self.__win_by_col_from_location(
-            row, col, player, left
-        ) or self.__win_by_row_from_location(
-            row, col, player, left
-        ) or self.__win_by_diagonal_left_down_from_location(
-            row, col, player, left
-        ) or self.__win_by_diagonal_left_up_from_location(
-            row, col, player, left
-        )
+    def __wins_through(self, mask, position):
+        line_masks = self.geometry.line_masks
+        for line in self.geometry.cell_lines[position]:
+            line_mask = line_masks[line]
+            if mask & line_mask == line_mask:
+                return True
+        return False
 
     def get_winner(self):
-        if len(list(self.valid_moves_iterator)) == 0:
+        if self.winner:
+            return self.winner
+        if self.is_full():
             return "draw"
-        for row in range(self.rows):
-            for col in range(self.columns):
-                piece = self.board[row][col]
-                if not piece:
-                    continue
-                player = piece.owner
-                if player.id == -1:
-                    continue
-                if self.__win_from_location(row, col, player, self.goal):
-                    LOGGER.debug("Winner is: " + player.name)
-                    return player
         return False
 
     def move_turn_to_next_player(self):
@@ -137,86 +141,155 @@ class Board(object):
         self.skip_players(-1)
 
     def skip_players(self, step):
-        next_player_index = (self.players.index(self.current_player) + step) % len(self.players)
-        self.current_player = self.players[next_player_index]
-
-    def put_one(self, _column):
-        LOGGER.debug("putting in column: %s" % str(_column))
-        _player = self.current_player
+        self.set_current_index((self.current_index + step) % len(self.players))
+
+    def put_one(self, _column, record=True):
+        """
+        moves searched rather than played are put with record=False, so they are kept
+        out of the history's variations
+        """
+        LOGGER.debug("putting in column: %s", _column)
         if self.get_winner():
             raise BoardWonError("Board already won by player: %s" % self.get_winner())
-        for row in reversed(range(self.rows)):
-            LOGGER.debug("row: %d, column: %d" % (row, _column))
-            _piece = self.board[row][_column]
-
-            LOGGER.debug("Trying to put %s in (%d, %d) - currently: %s" % (_player, row, _column, _piece))
-            if not _piece:
-                LOGGER.debug("old row: %r, changing column: %d", self.board[row], _column)
-                self.board[row] = tuple(
-                    piece if not column == _column else Piece(row, _column, _player) for column, piece in
-                    enumerate(self.board[row]))
-                LOGGER.debug("new row: %r", self.board[row])
-                self.move_turn_to_next_player()
-                self.moves = self.moves + ((self.current_player, row, _column,),)
-                return row, _column
-
-        raise LocationTakenError()
+        height = self.heights[_column]
+        if height == self.rows:
+            raise LocationTakenError()
+        row = self.rows - 1 - height
+        position = _column * self.column_bits + height
+        bit = 1 << position
+        mask = self.masks[self.current_index] | bit
+        self.masks[self.current_index] = mask
+        self.heights[_column] = height + 1
+        keys = self.piece_keys[self.current_index]
+        self.hash ^= keys[position]
+        self.mirror_hash ^= keys[self.geometry.mirror[position]]
+        self.victories.put(self.current_index, position)
+        if self.current_player.id != -1 and self.__wins_through(mask, position):
+            LOGGER.debug("Winner is: %s", self.current_player.name)
+            self.winner = self.current_player
+        self.move_turn_to_next_player()
+        if record:
+            self.history.push((self.current_player, row, _column))
+        else:
+            self.moves.append((self.current_player, row, _column))
+        return row, _column
 
     def undo(self):
-        if len(self.moves) > 0:
-            tempmoves = list(self.moves)
-            player, row, column = tempmoves.pop()
-            self.moves = tuple(tempmoves)
-            self.board[row] = tuple(
-                piece if not column == _column else None for _column, piece in
-                enumerate(self.board[row]))
+        if self.moves:
+            player, row, column = self.history.pop()
             self.move_turn_to_previous_player()
+            height = self.heights[column] - 1
+            position = column * self.column_bits + height
+            self.masks[self.current_index] &= ~(1 << position)
+            self.heights[column] = height
+            keys = self.piece_keys[self.current_index]
+            self.hash ^= keys[position]
+            self.mirror_hash ^= keys[self.geometry.mirror[position]]
+            self.victories.undo(self.current_index, position)
+            # a won board takes no more moves, so the position before any move had no winner
+            self.winner = False
             return row, column
         else:
             raise NoMovesPlayedError("No moves have been played yet!")
 
+    def redo(self):
+        # plays the move undone last from this position again
+        move = self.history.redo_move()
+        if move is None:
+            raise NoMovesUndoneError("No moves to redo!")
+        return self.put_one(move[2])
+
+    def redo_column(self):
+        move = self.history.redo_move()
+        return move and move[2]
+
+    def get_owner(self, x, y):
+        bit = self.bit(x, y)
+        for player, mask in zip(self.players, self.masks):
+            if mask & bit:
+                return player
+        return None
+
     def get_piece(self, x, y):
-        return self.board[x][y]
+        owner = self.get_owner(x, y)
+        return owner and Piece(x, y, owner)
 
     def get_players(self):
         return self.players
 
+    def position_key(self):
+        return self.hash, len(self.moves)
+
+    def canonical_key(self):
+        # the same for a position and its mirror image, caches keyed by it store mirrored moves
+        # (see mirror_column) when the board's hash isn't the canonical one
+        return min(self.hash, self.mirror_hash)
+
+    def is_symmetric(self):
+        return self.hash == self.mirror_hash
+
+    def mirror_column(self, column):
+        return self.columns - 1 - column
+
     def __str__(self):
         return os.linesep.join(
-            map(str, [map(lambda x: (x and "%d" % x.owner.id) or 'x', self.board[row]) for row in range(self.rows)])
+            str([(self.get_piece(row, col) and "%d" % self.get_piece(row, col).owner.id) or 'x'
+                 for col in range(self.columns)]) for row in range(self.rows)
         )
 
     @property
     def nrun_iterator(self):
-        for direction in self.directions:
-            for row in direction[2]:
-                for col in direction[3]:
-                    yield ((row + direction[0] * x, col + direction[1] * x) for x in xrange(self.goal))
+        return iter(self.geometry.lines)
 
     @property
     def valid_moves_iterator(self):
-        for i in xrange(len(self.board[0])):
+        rows = self.rows
+        for i, height in enumerate(self.heights):
             # check if column has room
-            if self.board[0][i] is None:
+            if height < rows:
                 yield i
 
-    def copy(self, move):
+    def copy(self, move=None):
 
-        LOGGER.debug("Creating copy of board with move: %s", str(move))
+        LOGGER.debug("Creating copy of board with move: %s", move)
         _board = Board(
-            self.players, rows=self.rows, columns=self.columns, goal=self.goal, moves=self.moves
+            self.players, rows=self.rows, columns=self.columns, goal=self.goal, tipheuristic=self.tipheuristic,
+            moves=self.moves
         )
 
         # these are not set correctly on initialization
-        _board.board = [x for x in self.board]
-        _board.current_player = self.current_player
-        _board.put_one(move)
+        _board.masks = list(self.masks)
+        _board.heights = list(self.heights)
+        _board.victories = self.victories.copy()
+        _board.current_index = self.current_index
+        _board.hash = self.hash
+        _board.mirror_hash = self.mirror_hash
+        _board.winner = self.winner
+        if move is not None:
+            _board.put_one(move)
         return _board
 
+    def __getstate__(self):
+        # pickled as the moves played from the starting player, replayed on unpickling
+        return {
+            "players": self.players,
+            "size": (self.rows, self.columns, self.goal),
+            "tipheuristic": self.tipheuristic,
+            "first": (self.current_index - len(self.moves)) % len(self.players),
+            "columns": [column for _, _, column in self.moves],
+        }
+
+    def __setstate__(self, state):
+        rows, columns, goal = state["size"]
+        self.__init__(state["players"], rows, columns, goal, tipheuristic=state["tipheuristic"])
+        self.set_current_index(state["first"])
+        for column in state["columns"]:
+            self.put_one(column)
+
     def simulate_move(self, move):
-        LOGGER.debug("simulating move: %s" % move)
+        LOGGER.debug("simulating move: %s", move)
         new_board = self.copy(move)
-        LOGGER.debug("%d X %d board initialized: %s" % (new_board.rows, new_board.columns, str(new_board)))
+        LOGGER.debug("%d X %d board initialized: %s", new_board.rows, new_board.columns, new_board)
         return new_board
 
 
@@ -262,6 +335,19 @@ class HumanPlayer(AbstractPlayer):
         return column
 
 
+def make_players(factory, count):
+    """
+    [factory(0), ..., factory(count - 1)], numbered from 1 like in a fresh process and without
+    changing the player count - for the players of searches and worker processes, not of games
+    """
+    saved = AbstractPlayer._ids
+    AbstractPlayer._ids = 1
+    try:
+        return [factory(index) for index in xrange(count)]
+    finally:
+        AbstractPlayer._ids = saved
+
+
 class BoardFullError(Exception):
     pass
 
@@ -269,22 +355,88 @@ class BoardFullError(Exception):
 class ComputerMinMaxPlayer(AbstractPlayer):
     _ids = 0
 
-    def __init__(self, heuristic_class, difficulty):
+    def __init__(self, heuristic_class, difficulty, table_megabytes=16, move_time=None, processes=1, use_book=True,
+                 store=None):
         super(ComputerMinMaxPlayer, self).__init__("pc-min-max-%d" % ComputerMinMaxPlayer._ids)
-        self.strategy = MinMaxStrategy(heuristic_class(self))
+        self.strategy = MinMaxStrategy(heuristic_class(self), table_megabytes=table_megabytes, store=store)
         self.difficulty = difficulty
+        # milliseconds per move, searched as deep as they allow instead of to a fixed difficulty
+        self.move_time = move_time
+        # worker processes for the root moves of fixed depth searches
+        self.processes = processes
+        # play the opening book's move (see connect4.logic.book) instead of searching when it has one
+        self.use_book = use_book
+        # (position after our move, (score, rest of the variation)) of the last search
+        self.last_search = None
+        # (position, (score, moves)) searched ahead while the opponent was thinking
+        self.pondered = None
+
+    def __search(self, board):
+        if self.move_time:
+            return self.strategy.search_timed(board, self.move_time)
+        if self.processes > 1:
+            return self.strategy.search_parallel(board, self.difficulty, self.processes)
+        return self.strategy.search(board, startdepth=self.difficulty)
+
+    def book_move(self, board):
+        """
+        (score, (move,)) of the opening book's move for board, None when the book doesn't have it
+        """
+        if not self.use_book:
+            return None
+        book = get_book(board.rows, board.columns, board.goal, len(board.players))
+        found = book.lookup(board) if book is not None else None
+        if found is None:
+            return None
+        LOGGER.debug("Book move: %d", found[0])
+        return found[1], (found[0],)
 
     def get_move(self, board, column):
-        LOGGER.debug("Computer player playing column: %d" % column)
+        LOGGER.debug("Computer player playing column: %s", column)
         winner = board.get_winner()
         if winner:
             raise BoardWonError("Board already won by %s" % winner)
         if board.is_full():
             raise BoardFullError("Board full. Undo or quit.")
-        state = self.strategy.get_move(board, startdepth=self.difficulty)
-        moves = tuple(s[2] for s in state.moves)
-        LOGGER.debug("Found moves: %s" % os.linesep.join(map(str, moves)))
-        return moves[len(board.moves):][0]
+        if self.pondered is not None and self.pondered[0] == board.position_key():
+            LOGGER.info("Opponent played the predicted move")
+            score, moves = self.pondered[1]
+        else:
+            found = self.book_move(board)
+            if found is not None:
+                # nothing searched for this move
+                self.strategy.statistics = SearchStatistics()
+                score, moves = found
+            else:
+                score, moves = self.__search(board)
+        self.pondered = None
+        self.last_search = board.copy(moves[0]).position_key(), (score, moves[1:])
+        LOGGER.debug("Found moves: %s (score: %d)", moves, score)
+        return moves[0]
+
+    def predict(self, board):
+        """
+        (score, moves) where moves[0] is the move this player expects from the opponent to move on board.
+        taken from the principal variation of the last search when it led here, searched otherwise.
+        """
+        if self.last_search is not None and self.last_search[0] == board.position_key() and self.last_search[1][1]:
+            return self.last_search[1]
+        found = self.book_move(board)
+        if found is not None:
+            return found
+        return self.strategy.alphabeta(board, max(1, self.difficulty - 1), maxplayer=self)
+
+    def ponder(self, board):
+        """
+        search the answer to the opponent's predicted move on board while the opponent thinks.
+        get_move answers at once if the opponent plays it, the table keeps the work otherwise.
+        returns the prediction.
+        """
+        prediction = self.predict(board)
+        reply = board.copy(prediction[1][0])
+        if not reply.get_winner():
+            self.pondered = reply.position_key(), self.__search(reply)
+        return prediction
 
 
 class Piece(object):
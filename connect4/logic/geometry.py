@@ -0,0 +1,64 @@
+__author__ = 'reut'
+
+
+def make_directions(rows, columns, goal):
+    # rowstep, colstep, start rows, start columns of every run of goal cells
+    return ((0, 1, xrange(rows), xrange(columns - goal + 1)),
+            (1, 0, xrange(rows - goal + 1), xrange(columns)),
+            (1, 1, xrange(rows - goal + 1), xrange(columns - goal + 1)),
+            (-1, 1, xrange(goal - 1, rows), xrange(columns - goal + 1)))
+
+
+class Geometry(object):
+    """
+    everything about a (rows, columns, goal) board that doesn't change while playing:
+    the bitboard layout, every winning line and the lines passing through each cell.
+    built once per geometry by get_geometry and shared by all boards.
+    """
+
+    def __init__(self, rows, columns, goal):
+        self.rows = rows
+        self.columns = columns
+        self.goal = goal
+        # every column takes rows + 1 bits (bottom cell first), the extra
+        # bit on top of each column is never set so runs can't wrap between columns.
+        self.column_bits = rows + 1
+        # bit steps of the four run directions: vertical, horizontal and both diagonals
+        self.steps = (1, self.column_bits, self.column_bits - 1, self.column_bits + 1)
+        # the bottom cell of every column, and every cell of the board
+        self.bottom = sum(1 << col * self.column_bits for col in xrange(columns))
+        self.full = self.bottom * ((1 << rows) - 1)
+
+        self.lines = tuple(
+            tuple((row + rowstep * x, col + colstep * x) for x in xrange(goal))
+            for rowstep, colstep, rows_range, columns_range in make_directions(rows, columns, goal)
+            for row in rows_range
+            for col in columns_range
+        )
+        self.line_masks = tuple(
+            sum(1 << self.position(row, col) for row, col in line) for line in self.lines
+        )
+        cell_lines = [[] for _ in xrange(columns * self.column_bits)]
+        for index, line in enumerate(self.lines):
+            for row, col in line:
+                cell_lines[self.position(row, col)].append(index)
+        # bitboard position -> indexes of the lines through it
+        self.cell_lines = tuple(tuple(indexes) for indexes in cell_lines)
+        # bitboard position -> the same cell in the left-right mirror image of the board
+        self.mirror = tuple(
+            (columns - 1 - position // self.column_bits) * self.column_bits + position % self.column_bits
+            for position in xrange(columns * self.column_bits)
+        )
+
+    def position(self, row, col):
+        return col * self.column_bits + self.rows - 1 - row
+
+
+_GEOMETRIES = {}
+
+
+def get_geometry(rows, columns, goal):
+    geometry = _GEOMETRIES.get((rows, columns, goal))
+    if geometry is None:
+        geometry = _GEOMETRIES[(rows, columns, goal)] = Geometry(rows, columns, goal)
+    return geometry
@@ -0,0 +1,370 @@
+"""
+monte carlo tree search (UCT) for the boards minimax can't see deep into.
+
+playouts run on plain bitboard lists instead of Boards, either random or guided (take a win,
+block the next player's win, random otherwise). the tree only expands a win, or the blocks of
+the next player's wins, when there are any. the tree is kept between moves and reused when
+the new position was reached from its root. with processes > 1 every worker grows its own tree
+for the position and their root statistics are added up (root parallelization).
+"""
+__author__ = 'reut'
+
+import logging
+import math
+import random
+import time
+
+from connect4.logic import game
+from connect4.logic.AI import SearchTimeout, SearchStatistics
+from connect4.logic.geometry import get_geometry
+
+LOGGER = logging.getLogger("connect4.mcts")
+
+# outcome of a node whose position is full without a winner
+DRAW = -1
+
+
+class Node(object):
+    __slots__ = ("move", "parent", "player", "children", "untried", "visits", "reward", "outcome")
+
+    def __init__(self, move, parent, player, untried, outcome=None):
+        self.move = move
+        self.parent = parent
+        # index of the player who made move, rewards are counted for this player
+        self.player = player
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.reward = 0.0
+        # None while the game goes on, else the winner's index or DRAW
+        self.outcome = outcome
+
+    def most_visited(self):
+        return max(self.children, key=lambda child: child.visits)
+
+
+def _wins(geometry, mask, position):
+    line_masks = geometry.line_masks
+    for line in geometry.cell_lines[position]:
+        line_mask = line_masks[line]
+        if mask & line_mask == line_mask:
+            return True
+    return False
+
+
+def _free_columns(geometry, heights):
+    rows = geometry.rows
+    return [col for col in xrange(geometry.columns) if heights[col] < rows]
+
+
+def _threats(geometry, masks, occupied):
+    # per player, the empty cells that would complete one of its lines
+    threats = [0] * len(masks)
+    for line_mask in geometry.line_masks:
+        for index, mask in enumerate(masks):
+            rest = line_mask & ~mask
+            if rest & (rest - 1) == 0 and not rest & occupied:
+                threats[index] |= rest
+    return threats
+
+
+def playout(geometry, masks, heights, current, rng, guided):
+    """
+    play random moves (for current first) on masks and heights until the game ends.
+    returns the winner's index, or DRAW
+    """
+    rows = geometry.rows
+    column_bits = geometry.column_bits
+    players = len(masks)
+    free = _free_columns(geometry, heights)
+    if not guided:
+        while free:
+            col = free[int(rng.random() * len(free))]
+            position = col * column_bits + heights[col]
+            heights[col] += 1
+            if heights[col] == rows:
+                free.remove(col)
+            mask = masks[current] | 1 << position
+            masks[current] = mask
+            if _wins(geometry, mask, position):
+                return current
+            current = (current + 1) % players
+        return DRAW
+
+    # guided: the threat cells of every player are kept up to date, a playable one of the player
+    # to move wins, a playable one of the next player is blocked
+    line_masks = geometry.line_masks
+    cell_lines = geometry.cell_lines
+    bottom, full = geometry.bottom, geometry.full
+    occupied = 0
+    for mask in masks:
+        occupied |= mask
+    threats = _threats(geometry, masks, occupied)
+    while free:
+        playable = (occupied + bottom) & full
+        if threats[current] & playable:
+            return current
+        following = (current + 1) % players
+        block = threats[following] & playable
+        if block:
+            col = ((block & -block).bit_length() - 1) // column_bits
+        else:
+            col = free[int(rng.random() * len(free))]
+        position = col * column_bits + heights[col]
+        heights[col] += 1
+        if heights[col] == rows:
+            free.remove(col)
+        bit = 1 << position
+        occupied |= bit
+        mask = masks[current] | bit
+        masks[current] = mask
+        # no playable cell won, so this move didn't - it can only add threats through its cell
+        for line in cell_lines[position]:
+            rest = line_masks[line] & ~mask
+            if rest & (rest - 1) == 0 and not rest & occupied:
+                threats[current] |= rest
+        current = following
+    return DRAW
+
+
+def _candidates(geometry, masks, heights, mover):
+    """
+    moves worth expanding for mover: a winning move if there is one, else the cells the next player
+    would win on if there are any, else every playable column
+    """
+    free = _free_columns(geometry, heights)
+    occupied = 0
+    for mask in masks:
+        occupied |= mask
+    threats = _threats(geometry, masks, occupied)
+    playable = (occupied + geometry.bottom) & geometry.full
+    column_bits = geometry.column_bits
+    for forced in (threats[mover] & playable, threats[(mover + 1) % len(masks)] & playable):
+        if forced:
+            return [col for col in free if forced >> col * column_bits + heights[col] & 1]
+    return free
+
+
+def _root_state(board):
+    # (geometry, masks, heights, player to move, columns played) of a Board
+    return (get_geometry(board.rows, board.columns, board.goal), list(board.masks), list(board.heights),
+            board.current_index, tuple(column for _, _, column in board.moves))
+
+
+def _search_worker(task):
+    # root statistics [(move, visits, reward)] of a tree grown in a pool worker
+    state, settings, playouts, milliseconds, seed = task
+    strategy = MonteCarloStrategy(seed=seed, **settings)
+    strategy.grow(state, playouts, milliseconds)
+    return [(child.move, child.visits, child.reward) for child in strategy.root.children], strategy.nodes
+
+
+class MonteCarloStrategy(object):
+    """
+    scores are the best move's average reward in thousandths: 1000 always wins, 0 always loses,
+    draws count as a share of 1 / players.
+    """
+
+    def __init__(self, playouts=20000, move_time=None, exploration=1.4, guided=True, processes=1, seed=None):
+        self.playouts = playouts
+        # milliseconds per search, instead of (or on top of) the playout budget
+        self.move_time = move_time
+        self.exploration = exploration
+        self.guided = guided
+        self.processes = processes
+        self.rng = random.Random(seed)
+        self.statistics = SearchStatistics()
+        self.stopped = False
+        self.root = None
+        self.root_columns = None
+        self.root_geometry = None
+        self.pool = None
+
+    def __getstate__(self):
+        # trees and worker pools stay in their process
+        state = dict(self.__dict__)
+        state["root"] = state["root_columns"] = state["pool"] = None
+        return state
+
+    @property
+    def nodes(self):
+        # playouts of the last search
+        return self.statistics.nodes
+
+    def __reuse(self, geometry, masks, current, columns):
+        """
+        the node of the kept tree for the position, found through the moves played since its root
+        """
+        root = self.root
+        if root is None or self.root_geometry != (geometry, len(masks)) or \
+                columns[:len(self.root_columns)] != self.root_columns:
+            return None
+        node = root
+        for move in columns[len(self.root_columns):]:
+            node = next((child for child in node.children if child.move == move), None)
+            if node is None:
+                return None
+        # the same columns from another first player are another position
+        if node.player != (current - 1) % len(masks):
+            return None
+        node.parent = None
+        return node
+
+    def grow(self, state, playouts=None, milliseconds=None):
+        """
+        run playouts from the position of state (see _root_state) into the kept tree
+        """
+        geometry, masks, heights, current, columns = state
+        players = len(masks)
+        root = self.__reuse(geometry, masks, current, columns)
+        if root is None:
+            root = Node(None, None, (current - 1) % players, _candidates(geometry, masks, heights, current))
+        self.root, self.root_columns, self.root_geometry = root, columns, (geometry, players)
+
+        rows = geometry.rows
+        column_bits = geometry.column_bits
+        exploration = self.exploration
+        guided = self.guided
+        rng = self.rng
+        draw = 1.0 / players
+        log = math.log
+        sqrt = math.sqrt
+        deadline = time.time() + milliseconds / 1000.0 if milliseconds else None
+        statistics = self.statistics
+        start = statistics.nodes
+        while playouts is None or statistics.nodes - start < playouts:
+            # the deadline lets a first child be expanded, so there is a move to return
+            if self.stopped or deadline is not None and root.children and time.time() > deadline:
+                if self.stopped:
+                    raise SearchTimeout()
+                break
+            statistics.nodes += 1
+            node = root
+            node_masks = list(masks)
+            node_heights = list(heights)
+
+            # selection: UCB1 down the fully expanded part of the tree
+            while not node.untried and node.children and node.outcome is None:
+                scale = exploration * sqrt(log(node.visits))
+                node = max(
+                    node.children,
+                    key=lambda child: child.reward / child.visits + scale / sqrt(child.visits)
+                )
+                position = node.move * column_bits + node_heights[node.move]
+                node_heights[node.move] += 1
+                node_masks[node.player] |= 1 << position
+            mover = (node.player + 1) % players
+
+            # expansion: one untried move
+            if node.outcome is None and node.untried:
+                move = node.untried.pop(int(rng.random() * len(node.untried)))
+                position = move * column_bits + node_heights[move]
+                node_heights[move] += 1
+                node_masks[mover] |= 1 << position
+                if _wins(geometry, node_masks[mover], position):
+                    child = Node(move, node, mover, [], mover)
+                elif any(height < rows for height in node_heights):
+                    following = (mover + 1) % players
+                    child = Node(move, node, mover, _candidates(geometry, node_masks, node_heights, following))
+                else:
+                    child = Node(move, node, mover, [], DRAW)
+                node.children.append(child)
+                node = child
+                mover = (mover + 1) % players
+
+            # simulation
+            if node.outcome is not None:
+                outcome = node.outcome
+            else:
+                outcome = playout(geometry, node_masks, node_heights, mover, rng, guided)
+
+            # backpropagation
+            while node is not None:
+                node.visits += 1
+                if outcome == node.player:
+                    node.reward += 1.0
+                elif outcome == DRAW:
+                    node.reward += draw
+                node = node.parent
+        return root
+
+    def search(self, board, playouts=None, milliseconds=None):
+        """
+        (score, moves) where moves follow the most visited children from board.
+        raises SearchTimeout when the strategy is stopped.
+        """
+        if board.get_winner():
+            raise ValueError("the game is over")
+        playouts = playouts if playouts is not None else self.playouts
+        milliseconds = milliseconds if milliseconds is not None else self.move_time
+        started = time.time()
+        self.statistics = SearchStatistics()
+        state = _root_state(board)
+        if self.processes > 1:
+            return self.__search_parallel(state, playouts, milliseconds, started)
+
+        root = self.grow(state, playouts, milliseconds)
+        moves = []
+        node = root
+        while node.children:
+            node = node.most_visited()
+            moves.append(node.move)
+        best = root.most_visited()
+        self.statistics.seconds = time.time() - started
+        LOGGER.info("Best moves: %s after %d playouts (%d visits of %d)", moves, self.statistics.nodes,
+                    best.visits, root.visits)
+        return int(1000 * best.reward / best.visits), tuple(moves)
+
+    def __search_parallel(self, state, playouts, milliseconds, started):
+        if self.pool is None:
+            import multiprocessing
+            self.pool = multiprocessing.Pool(self.processes)
+        settings = {"exploration": self.exploration, "guided": self.guided}
+        share = -(-playouts // self.processes) if playouts is not None else None
+        results = self.pool.map(
+            _search_worker,
+            [(state, settings, share, milliseconds, self.rng.getrandbits(32)) for _ in xrange(self.processes)],
+            chunksize=1
+        )
+        totals = {}
+        for children, nodes in results:
+            self.statistics.nodes += nodes
+            for move, visits, reward in children:
+                before = totals.get(move, (0, 0.0))
+                totals[move] = before[0] + visits, before[1] + reward
+        move, (visits, reward) = max(totals.items(), key=lambda item: item[1][0])
+        self.statistics.seconds = time.time() - started
+        LOGGER.info("Best move: %d after %d playouts in %d processes", move, self.statistics.nodes, self.processes)
+        return int(1000 * reward / visits), (move,)
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def get_move(self, board, playouts=None):
+        # the board reached by following the principal variation, like MinMaxStrategy.get_move
+        score, moves = self.search(board, playouts)
+        best = board.copy(moves[0])
+        for move in moves[1:]:
+            best.put_one(move)
+        return best
+
+
+class ComputerMonteCarloPlayer(game.AbstractPlayer):
+    def __init__(self, playouts=20000, move_time=None, processes=1, guided=True):
+        super(ComputerMonteCarloPlayer, self).__init__("pc-mcts")
+        self.strategy = MonteCarloStrategy(playouts, move_time, guided=guided, processes=processes)
+
+    def get_move(self, board, column):
+        winner = board.get_winner()
+        if winner:
+            raise game.BoardWonError("Board already won by %s" % winner)
+        if board.is_full():
+            raise game.BoardFullError("Board full. Undo or quit.")
+        score, moves = self.strategy.search(board)
+        LOGGER.debug("Found moves: %s (score: %d)", moves, score)
+        return moves[0]
@@ -0,0 +1,316 @@
+"""
+exact two player solver: the game theoretic value of a position instead of a heuristic guess.
+
+scores follow the usual connect 4 convention, from the point of view of the player to move:
+0 for a draw, positive when the player to move wins - the sooner the higher, one point per
+own move saved - and negative when it loses.
+"""
+__author__ = 'reut'
+
+import logging
+
+from connect4.logic.geometry import get_geometry
+
+LOGGER = logging.getLogger("connect4.solver")
+
+WIN = "win"
+LOSS = "loss"
+DRAW = "draw"
+
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+class SolverGeometry(object):
+    """
+    bit masks of a (rows, columns, goal) board for the solver, on the board's own bitboard layout
+    """
+
+    def __init__(self, rows, columns, goal):
+        geometry = get_geometry(rows, columns, goal)
+        self.rows = rows
+        self.columns = columns
+        self.goal = goal
+        self.cells = rows * columns
+        column_bits = geometry.column_bits
+        self.bottom = geometry.bottom
+        self.board = geometry.full
+        # columns from the center out, center moves take part in the most lines
+        self.order = tuple(sorted(xrange(columns), key=lambda col: (abs(2 * col - columns + 1), col)))
+        self.column_masks = tuple(((1 << rows) - 1) << col * column_bits for col in xrange(columns))
+        # (vertical step, horizontal and diagonal steps)
+        self.vertical = geometry.steps[0]
+        self.steps = geometry.steps[1:]
+        self.winning_positions = winning_positions(self)
+
+    def possible(self, mask):
+        return (mask + self.bottom) & self.board
+
+
+def winning_positions(geometry):
+    """
+    function of (position, mask) to the empty cells that would complete a line of goal stones of position
+    """
+    goal = geometry.goal
+    board = geometry.board
+    vertical = geometry.vertical
+    if goal == 4:
+        # unrolled for the usual goal: every way three stones and an empty cell make a line
+        h1, d1, a1 = geometry.steps
+        h2, d2, a2 = 2 * h1, 2 * d1, 2 * a1
+        h3, d3, a3 = 3 * h1, 3 * d1, 3 * a1
+
+        def four(position, mask):
+            threats = (position << 1) & (position << 2) & (position << 3)
+            pair = (position << h1) & (position << h2)
+            threats |= pair & ((position << h3) | (position >> h1))
+            pair = (position >> h1) & (position >> h2)
+            threats |= pair & ((position << h1) | (position >> h3))
+            pair = (position << d1) & (position << d2)
+            threats |= pair & ((position << d3) | (position >> d1))
+            pair = (position >> d1) & (position >> d2)
+            threats |= pair & ((position << d1) | (position >> d3))
+            pair = (position << a1) & (position << a2)
+            threats |= pair & ((position << a3) | (position >> a1))
+            pair = (position >> a1) & (position >> a2)
+            threats |= pair & ((position << a1) | (position >> a3))
+            return threats & (board ^ mask)
+        return four
+
+    # for every direction and every place of the empty cell in the line, the shifts
+    # bringing the other goal - 1 stones onto it (positive shifts left, negative right)
+    vertical_shifts = tuple(count * vertical for count in xrange(1, goal))
+    line_shifts = tuple(
+        tuple((before - count) * step for count in xrange(goal) if count != before)
+        for step in geometry.steps
+        for before in xrange(goal)
+    )
+
+    def any_goal(position, mask):
+        # only the cell right above goal - 1 stacked stones
+        threats = -1
+        for shift in vertical_shifts:
+            threats &= position << shift
+        for shifts in line_shifts:
+            line = -1
+            for shift in shifts:
+                line &= position << shift if shift > 0 else position >> -shift
+            threats |= line
+        return threats & (board ^ mask)
+    return any_goal
+
+
+_SOLVER_GEOMETRIES = {}
+
+
+def get_solver_geometry(rows, columns, goal):
+    geometry = _SOLVER_GEOMETRIES.get((rows, columns, goal))
+    if geometry is None:
+        geometry = _SOLVER_GEOMETRIES[(rows, columns, goal)] = SolverGeometry(rows, columns, goal)
+    return geometry
+
+
+class Solver(object):
+    """
+    null window negamax with a transposition table, narrowing the score window between searches
+    (iterative deepening on the score rather than the depth).
+    positions are encoded as (stones of the player to move, all stones) bit masks.
+    """
+
+    def __init__(self, table_entries=1 << 21):
+        # key: position + mask, value: bound on the score. both tables are cleared when they fill up
+        self.table_entries = table_entries
+        self.upper = {}
+        self.lower = {}
+        self.nodes = 0
+
+    def clear(self):
+        self.upper.clear()
+        self.lower.clear()
+
+    def encode(self, board):
+        """
+        (solver geometry, stones of the player to move, all stones, stones played) of a two player board
+        """
+        if len(board.players) != 2:
+            raise ValueError("the solver handles two player games only")
+        geometry = get_solver_geometry(board.rows, board.columns, board.goal)
+        position = board.masks[board.current_index]
+        mask = position | board.masks[1 - board.current_index]
+        return geometry, position, mask, popcount(mask)
+
+    def solve(self, board, weak=False):
+        """
+        exact score of board for the player to move (weak: only its sign, -1, 0 or 1)
+        """
+        geometry, position, mask, played = self.encode(board)
+        self.nodes = 0
+        if board.winner:
+            # the previous player just won
+            score = -1 if weak else -((geometry.cells + 2 - played) // 2)
+        else:
+            score = self.__solve(geometry, position, mask, played, weak)
+        LOGGER.info("Solved position in %d nodes: %d", self.nodes, score)
+        return score
+
+    def result(self, board):
+        """
+        (WIN, LOSS or DRAW for the player to move, plies until the game ends with perfect play)
+        """
+        score = self.solve(board)
+        return outcome(score, board.rows * board.columns, popcount(board.masks[0] | board.masks[1]))
+
+    def best_move(self, board):
+        """
+        (column, score) of the best move on board for the player to move, the quickest win
+        or the slowest loss
+        """
+        geometry, position, mask, played = self.encode(board)
+        if board.winner or played == geometry.cells:
+            raise ValueError("the game is over")
+        self.nodes = 0
+        possible = geometry.possible(mask)
+        wins = geometry.winning_positions(position, mask) & possible
+        if wins:
+            for col in geometry.order:
+                if wins & geometry.column_masks[col]:
+                    return col, (geometry.cells + 1 - played) // 2
+        score = self.__solve(geometry, position, mask, played, False)
+        # the first move the table proves to be worth score, most searches are answered from it
+        opponent = position ^ mask
+        for col in geometry.order:
+            move = possible & geometry.column_masks[col]
+            if not move:
+                continue
+            if geometry.winning_positions(opponent, mask | move) & geometry.possible(mask | move):
+                # the opponent would win at once
+                if -((geometry.cells - played) // 2) == score:
+                    return col, score
+                continue
+            if self.negamax(geometry, opponent, mask | move, played + 1, -score, 1 - score) <= -score:
+                return col, score
+
+    def __solve(self, geometry, position, mask, played, weak):
+        cells = geometry.cells
+        if played == cells:
+            return 0
+        if geometry.winning_positions(position, mask) & geometry.possible(mask):
+            return 1 if weak else (cells + 1 - played) // 2
+        low = -((cells - played) // 2)
+        high = (cells + 1 - played) // 2
+        if weak:
+            low, high = -1, 1
+        while low < high:
+            # null window searches, halving the window towards 0 (draws are the most common)
+            middle = low + (high - low) // 2
+            if middle <= 0 and -(-low // 2) < middle:
+                middle = -(-low // 2)
+            elif middle >= 0 and high // 2 > middle:
+                middle = high // 2
+            score = self.negamax(geometry, position, mask, played, middle, middle + 1)
+            if score <= middle:
+                high = score
+            else:
+                low = score
+        if weak:
+            # a null window search proves a bound, which can be past the sign
+            return max(-1, min(1, low))
+        return low
+
+    def negamax(self, geometry, position, mask, played, alpha, beta):
+        """
+        score of a position the player to move can't win at once, exact within (alpha, beta) -
+        at most alpha when the score is lower, at least beta when it is higher
+        """
+        cells = geometry.cells
+        bottom = geometry.bottom
+        board = geometry.board
+        vertical = geometry.vertical
+        order = geometry.order
+        column_masks = geometry.column_masks
+        winning_positions = geometry.winning_positions
+        upper = self.upper
+        lower = self.lower
+        entries = self.table_entries
+        nodes = [0]
+
+        def __negamax(position, mask, played, alpha, beta):
+            nodes[0] += 1
+            possible = (mask + bottom) & board
+            opponent_wins = winning_positions(position ^ mask, mask)
+            forced = possible & opponent_wins
+            if forced:
+                if forced & (forced - 1):
+                    # two threats to block
+                    return -((cells - played) // 2)
+                possible = forced
+            # never play right below a cell the opponent would win on
+            possible &= ~(opponent_wins >> vertical)
+            if not possible:
+                return -((cells - played) // 2)
+            if played >= cells - 2:
+                # the moves left can't win
+                return 0
+
+            # the opponent can't win on its next move, so neither side wins sooner than this
+            low = -((cells - 2 - played) // 2)
+            if alpha < low:
+                alpha = low
+                if alpha >= beta:
+                    return alpha
+            high = (cells - 1 - played) // 2
+            key = position + mask
+            bound = upper.get(key)
+            if bound is not None and bound < high:
+                high = bound
+            if beta > high:
+                beta = high
+                if alpha >= beta:
+                    return beta
+            bound = lower.get(key)
+            if bound is not None and bound > alpha:
+                alpha = bound
+                if alpha >= beta:
+                    return alpha
+
+            # moves creating the most threats first, center first on ties
+            moves = []
+            for col in order:
+                move = possible & column_masks[col]
+                if move:
+                    moves.append((-popcount(winning_positions(position | move, mask)), len(moves), move))
+            moves.sort()
+
+            opponent = position ^ mask
+            for _, _, move in moves:
+                score = -__negamax(opponent, mask | move, played + 1, -beta, -alpha)
+                if score >= beta:
+                    if len(lower) >= entries:
+                        lower.clear()
+                    lower[key] = score
+                    return score
+                if score > alpha:
+                    alpha = score
+            if len(upper) >= entries:
+                upper.clear()
+            upper[key] = alpha
+            return alpha
+
+        try:
+            return __negamax(position, mask, played, alpha, beta)
+        finally:
+            self.nodes += nodes[0]
+
+
+def outcome(score, cells, played):
+    """
+    (WIN, LOSS or DRAW, plies until the game ends) of a score for the player to move
+    after played stones on a board of cells
+    """
+    if score == 0:
+        return DRAW, cells - played
+    if score > 0:
+        # the winning stone is placed when (cells + 1 - stones played) // 2 drops to score
+        return WIN, 2 * ((cells + 1 - played) // 2 - score) + 1
+    return LOSS, 2 * ((cells - played) // 2 + score) + 2
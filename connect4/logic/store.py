@@ -0,0 +1,161 @@
+"""
+persistent evaluation store: root search results kept in a SQLite file across runs and processes.
+
+    strategy = MinMaxStrategy(heuristic, store=EvaluationStore("evaluations.db"))
+
+entries are keyed by the position's canonical key, the geometry and the heuristic, and hold the
+search depth, the score for the player to move and the best move (stored like the transposition
+table does, for the position whose hash is the key). the file is opened in WAL mode so several
+processes can read and write it at once, and the oldest entries are dropped when it grows past
+max_entries.
+"""
+__author__ = 'reut'
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+LOGGER = logging.getLogger("connect4.store")
+
+# connections inherited through fork. they are never used or closed in the child, closing the
+# last connection to a WAL file checkpoints it under the parent's feet
+_inherited = []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    key INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    columns INTEGER NOT NULL,
+    goal INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    heuristic TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    written REAL NOT NULL,
+    PRIMARY KEY (key, rows, columns, goal, players, heuristic)
+);
+CREATE INDEX IF NOT EXISTS evaluations_written ON evaluations (written);
+"""
+
+
+def _signed(key):
+    # sqlite integers are signed 64 bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class EvaluationStore(object):
+    """
+    the schema is created when the store is made, before any worker process uses the file.
+    the connection is opened lazily in every process - whether the store reached it pickled with
+    its strategy or through fork - and shared by the threads of a process under a lock
+    """
+
+    def __init__(self, path, max_entries=1000000, min_depth=6, timeout=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        # shallower results are cheaper to search again than to store
+        self.min_depth = min_depth
+        self.timeout = timeout
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.writes = 0
+        with self.lock:
+            self.__connect().executescript(SCHEMA)
+        # so a store handed to a pool carries no connection into the workers
+        self.close()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["connection"] = None
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __connect(self):
+        if self.connection is not None and self.pid != os.getpid():
+            _inherited.append(self.connection)
+            self.connection = None
+        if self.connection is None:
+            self.pid = os.getpid()
+            self.connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        return self.connection
+
+    @staticmethod
+    def __where(board, heuristic):
+        key = board.canonical_key()
+        return key, (_signed(key), board.rows, board.columns, board.goal, len(board.players),
+                     type(heuristic).__name__)
+
+    def get(self, board, heuristic, depth):
+        """
+        (depth, score, moves) stored for board searched at least to depth by heuristic, or None
+        """
+        key, where = self.__where(board, heuristic)
+        with self.lock:
+            row = self.__connect().execute(
+                "SELECT depth, score, move FROM evaluations WHERE key = ? AND rows = ? AND columns = ? "
+                "AND goal = ? AND players = ? AND heuristic = ? AND depth >= ?", where + (depth,)
+            ).fetchone()
+        if row is None:
+            return None
+        stored, score, move = row
+        if key != board.hash:
+            move = board.mirror_column(move)
+        return stored, score, (move,)
+
+    def put(self, board, heuristic, depth, best):
+        """
+        store the (score, moves) search result of board, unless it is shallow or a deeper one is stored
+        """
+        score, moves = best
+        if depth < self.min_depth or not moves:
+            return
+        key, where = self.__where(board, heuristic)
+        move = moves[0] if key == board.hash else board.mirror_column(moves[0])
+        with self.lock:
+            connection = self.__connect()
+            with connection:
+                # one statement, so it is atomic between processes - and no upsert, which needs sqlite 3.24
+                connection.execute(
+                    "INSERT OR REPLACE INTO evaluations SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ? "
+                    "WHERE NOT EXISTS (SELECT 1 FROM evaluations WHERE key = ? AND rows = ? AND columns = ? "
+                    "AND goal = ? AND players = ? AND heuristic = ? AND depth > ?)",
+                    where + (depth, score, move, time.time()) + where + (depth,)
+                )
+            self.writes += 1
+            if self.writes % 256 == 0:
+                self.__evict(connection)
+
+    def __evict(self, connection):
+        count, = connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()
+        if count <= self.max_entries:
+            return
+        # down to 90% so eviction doesn't run on every check
+        surplus = count - self.max_entries * 9 // 10
+        LOGGER.info("Evicting %d evaluations from %s", surplus, self.path)
+        with connection:
+            connection.execute(
+                "DELETE FROM evaluations WHERE rowid IN "
+                "(SELECT rowid FROM evaluations ORDER BY written LIMIT ?)", (surplus,)
+            )
+
+    def __len__(self):
+        with self.lock:
+            return self.__connect().execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.pid != os.getpid():
+                _inherited.append(self.connection)
+            elif self.connection is not None:
+                self.connection.close()
+            self.connection = None
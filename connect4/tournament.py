@@ -0,0 +1,181 @@
+"""
+headless self-play between two ComputerMinMaxPlayer configurations, spread over a process pool.
+
+    connect4-tournament --games 1000 --depths 4 5 --processes 8 --output games.jsonl
+
+every finished game is written as a json line, a summary is printed at the end.
+"""
+__author__ = 'reut'
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+
+from connect4 import configure_logging
+from connect4.logic import game
+from connect4.logic import AI
+from connect4.logic.store import EvaluationStore
+
+# the two players of this process, made once per worker by _init_worker
+_players = None
+_settings = None
+
+
+def _init_worker(settings):
+    global _players, _settings
+    _settings = settings
+    store = EvaluationStore(settings["store"]) if settings["store"] else None
+    configurations = zip(settings["heuristics"], settings["depths"])
+
+    def player(index):
+        heuristic, depth = configurations[index]
+        return game.ComputerMinMaxPlayer(getattr(AI, heuristic), depth, move_time=settings["move_time"],
+                                         use_book=settings["book"], store=store)
+
+    _players = game.make_players(player, len(configurations))
+
+
+def play_game(index):
+    """
+    play game number index: players alternate who starts, and a few random opening moves
+    drawn from the game's seed keep the (deterministic) engines from replaying one game
+    """
+    seed = _settings["seed"] + index
+    rng = random.Random(seed)
+    board = game.Board(_players, _settings["rows"], _settings["columns"], _settings["goal"])
+    first = index % 2
+    board.current_player = _players[first]
+    for player in _players:
+        player.strategy.table.clear()
+        player.last_search = player.pondered = None
+
+    opening = []
+    for _ in xrange(_settings["opening"]):
+        column = rng.choice(list(board.valid_moves_iterator))
+        board.put_one(column)
+        opening.append(column)
+        if board.get_winner():
+            board.undo()
+            opening.pop()
+            break
+
+    moves = []
+    latencies = [[], []]
+    nodes = [0, 0]
+    start = time.time()
+    while not board.get_winner():
+        side = board.current_index
+        player = board.current_player
+        moved = time.time()
+        column = player.get_move(board, None)
+        latencies[side].append((time.time() - moved) * 1000)
+        nodes[side] += player.strategy.nodes
+        board.put_one(column)
+        moves.append(column)
+
+    winner = board.get_winner()
+    return {
+        "game": index,
+        "seed": seed,
+        "first": "ab"[first],
+        "opening": opening,
+        "moves": moves,
+        "winner": "draw" if winner == "draw" else "ab"[_players.index(winner)],
+        "seconds": time.time() - start,
+        "nodes": nodes,
+        "latencies": latencies,
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(results, seconds):
+    games = len(results)
+    summary = {"games": games, "seconds": seconds, "games_per_second": games / seconds if seconds else 0.0}
+    for outcome in ("a", "b", "draw"):
+        summary[outcome] = sum(1 for result in results if result["winner"] == outcome) / float(games or 1)
+    for side, name in enumerate("ab"):
+        latencies = [latency for result in results for latency in result["latencies"][side]]
+        thinking = sum(latencies) / 1000.0
+        nodes = sum(result["nodes"][side] for result in results)
+        summary["nodes_per_second_" + name] = nodes / thinking if thinking else 0.0
+        for fraction in (0.5, 0.9, 0.99, 1.0):
+            summary["latency_p%d_%s_ms" % (fraction * 100, name)] = percentile(latencies, fraction)
+    return summary
+
+
+def run(settings, games, processes, output=None):
+    """
+    play games and return the summary, streaming every game to the output file as it finishes
+    """
+    start = time.time()
+    if settings["store"]:
+        # made here first, so the workers find its schema
+        EvaluationStore(settings["store"]).close()
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, _init_worker, (settings,))
+        played = pool.imap_unordered(play_game, xrange(games))
+    else:
+        pool = None
+        _init_worker(settings)
+        played = (play_game(index) for index in xrange(games))
+
+    results = []
+    try:
+        for result in played:
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return summarize(results, time.time() - start)
+
+
+def main(argv=None):
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Headless connect 4 self-play tournament.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--columns", type=int, default=7)
+    parser.add_argument("--goal", type=int, default=4)
+    parser.add_argument("--depths", type=int, nargs=2, default=(4, 4), metavar=("A", "B"))
+    parser.add_argument("--heuristics", nargs=2, default=("AvailableVictoriesHeuristic",) * 2, metavar=("A", "B"))
+    parser.add_argument("--move-time", type=int, default=None,
+                        help="milliseconds per move (iterative deepening) instead of fixed depths")
+    parser.add_argument("--opening", type=int, default=2, help="random opening moves per game")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-book", action="store_true", help="search the openings instead of using the book")
+    parser.add_argument("--store", help="sqlite evaluation store shared by the workers and kept between runs")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", help="json lines file for the games")
+    args = parser.parse_args(argv)
+
+    settings = {
+        "rows": args.rows,
+        "columns": args.columns,
+        "goal": args.goal,
+        "depths": args.depths,
+        "heuristics": args.heuristics,
+        "move_time": args.move_time,
+        "opening": args.opening,
+        "seed": args.seed,
+        "book": not args.no_book,
+        "store": args.store,
+    }
+    output = open(args.output, "w") if args.output else None
+    try:
+        summary = run(settings, args.games, args.processes, output)
+    finally:
+        if output is not None:
+            output.close()
+    for key in sorted(summary):
+        print "%s: %s" % (key, summary[key])
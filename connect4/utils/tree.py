@@ -1,35 +1,101 @@
 __author__ = 'reut'
 
-import logging
 import os
-LOGGER = logging.getLogger("Tree")
-sh = logging.StreamHandler()
-sh.setLevel(logging.DEBUG)
-LOGGER.addHandler(sh)
-LOGGER.setLevel(logging.INFO)
 
 
-# absorb and replace last state? open-listing of states... (just guessing)
 class Tree(object):
+    """
+    a node of a tree of variations. every node of a tree shares the set of its leaves,
+    so leaves are tracked in O(1) as children are added.
+    """
 
     def __init__(self, data, parent=None):
-        self.leaves = parent.leaves if parent else [self]
+        self.leaves = parent.leaves if parent else set([self])
         self.parent = parent
         self.depth = parent.depth + 1 if parent else 0
         self.data = data
         self.children = []
+        # the child visited last, followed by redo
+        self.last = None
 
     def add_child(self, data):
-        try:
-            self.leaves.remove(self)
-        except ValueError:
-            LOGGER.debug("%s Not in tree..." % self)
+        self.leaves.discard(self)
         child = Tree(data=data, parent=self)
         self.children.append(child)
-        self.leaves.append(child)
+        self.leaves.add(child)
+        return child
+
+    def child(self, data):
+        # the child holding data, or None. a node has at most a child per column
+        for child in self.children:
+            if child.data == data:
+                return child
+        return None
+
+    def path(self):
+        # data of the nodes from the root's first child down to this node
+        path = []
+        node = self
+        while node.parent is not None:
+            path.append(node.data)
+            node = node.parent
+        path.reverse()
+        return path
 
     def __str__(self):
         return os.linesep.join(["Tree:", "data:", "%s", "children:", "%s"]) % (self.data, self.children)
 
     def __repr__(self):
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
+
+
+class GameRecord(object):
+    """
+    moves of a game and every variation tried from it, with a cursor on the current position.
+    push, pop (undo) and redo_move are O(1): pushing a move already tried from the cursor's position
+    follows it instead of adding a variation, popping keeps the moves for redo.
+    moves holds the moves up to the cursor. moves appended to it directly (searched rather than
+    played) stay out of the tree, and so do the moves pushed after them until they are popped
+    """
+
+    def __init__(self, moves=()):
+        self.root = Tree(None)
+        self.node = self.root
+        self.moves = []
+        for move in moves:
+            self.push(move)
+
+    def push(self, move):
+        moves = self.moves
+        node = self.node
+        if len(moves) == node.depth:
+            child = node.child(move) or node.add_child(move)
+            node.last = child
+            self.node = child
+        moves.append(move)
+
+    def pop(self):
+        move = self.moves.pop()
+        node = self.node
+        if len(self.moves) < node.depth:
+            node.parent.last = node
+            self.node = node.parent
+        return move
+
+    def redo_move(self):
+        """
+        the move popped last from the current position (the one to push again to redo), or None
+        """
+        if len(self.moves) != self.node.depth or self.node.last is None:
+            return None
+        return self.node.last.data
+
+    def variations(self):
+        # moves from the start of every line played to its end, the order is arbitrary
+        return [leaf.path() for leaf in self.root.leaves if leaf is not self.root]
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __iter__(self):
+        return iter(self.moves)
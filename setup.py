@@ -29,6 +29,20 @@ setup(
     keywords = ['games', 'board games'],
     # You can just specify the packages manually here if your project is
     #  simple. Or you can use find_packages().
-    packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
-    install_requires=['']
+    packages=find_packages(exclude=['contrib', 'docs', 'tests*', 'benchmarks*']),
+    package_data={
+        'connect4.logic': ['books/*.book'],
+    },
+    install_requires=[''],
+    extras_require={
+        'batch': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'connect4=connect4.gui.gui:main',
+            'connect4-tournament=connect4.tournament:main',
+            'connect4-book=connect4.logic.book:main',
+            'connect4-analyze=connect4.logic.analysis:main',
+        ],
+    }
 )
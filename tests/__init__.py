@@ -0,0 +1,26 @@
+"""
+differential checks: the engine's fast paths against slow, obviously correct versions on small boards.
+
+    python -m unittest discover tests
+"""
+__author__ = 'reut'
+
+from connect4.logic import game
+
+
+def make_players(count):
+    return game.make_players(lambda index: game.HumanPlayer("test %d" % index), count)
+
+
+def random_board(rng, players, rows, columns, goal, moves, undo=0.0):
+    """
+    a board after up to moves random moves (each taken back with probability undo), stopping before a win
+    """
+    board = game.Board(players, rows, columns, goal)
+    for _ in xrange(moves):
+        if board.is_full():
+            break
+        board.put_one(rng.choice(list(board.valid_moves_iterator)))
+        if board.get_winner() or rng.random() < undo:
+            board.undo()
+    return board
@@ -0,0 +1,64 @@
+__author__ = 'reut'
+
+import random
+import unittest
+
+from connect4.logic import AI, batch
+from tests import make_players, random_board
+
+
+def recount(board, player):
+    # AvailableVictoriesHeuristic scored from the cells, line by line
+    score = 0
+    for row in xrange(board.rows):
+        for column in xrange(board.columns):
+            for step_row, step_column in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                cells = [(row + step_row * index, column + step_column * index) for index in xrange(board.goal)]
+                if not all(0 <= cell_row < board.rows and 0 <= cell_column < board.columns
+                           for cell_row, cell_column in cells):
+                    continue
+                owners = [board.get_owner(cell_row, cell_column) for cell_row, cell_column in cells]
+                taken = [owner for owner in owners if owner]
+                if not taken:
+                    score -= 1
+                elif len(set(taken)) == 1:
+                    score += 2 ** len(taken) if taken[0] is player else -(3 ** len(taken))
+    return score
+
+
+class AvailableVictoriesTest(unittest.TestCase):
+    def test_incremental_scores_match_a_recount(self):
+        players = make_players(3)
+        for seed in xrange(100):
+            rng = random.Random(seed)
+            board = random_board(rng, players[:rng.randint(2, 3)], rng.randint(3, 8), rng.randint(3, 8),
+                                 rng.randint(3, 5), rng.randint(0, 40), undo=0.3)
+            for player in board.players:
+                self.assertEqual(AI.AvailableVictoriesHeuristic(player).value(board), recount(board, player),
+                                 "seed %d" % seed)
+
+    def test_copies_keep_scoring(self):
+        players = make_players(2)
+        rng = random.Random(0)
+        board = random_board(rng, players, 6, 7, 4, 10)
+        for move in list(board.valid_moves_iterator):
+            child = board.copy(move)
+            if not child.get_winner():
+                self.assertEqual(AI.AvailableVictoriesHeuristic(players[0]).value(child), recount(child, players[0]))
+
+    @unittest.skipIf(batch.numpy is None, "needs numpy")
+    def test_batch_scores_match_the_heuristic(self):
+        players = make_players(3)
+        for seed in xrange(20):
+            rng = random.Random(seed)
+            count, rows, columns, goal = rng.randint(2, 3), rng.randint(3, 9), rng.randint(3, 9), rng.randint(3, 5)
+            boards = [random_board(rng, players[:count], rows, columns, goal, rng.randint(0, rows * columns))
+                      for _ in xrange(10)]
+            for player in players[:count]:
+                self.assertEqual(batch.AvailableVictoriesBatchHeuristic(player).values(boards),
+                                 [AI.AvailableVictoriesHeuristic(player).value(board) for board in boards],
+                                 "seed %d" % seed)
+
+
+if __name__ == "__main__":
+    unittest.main()
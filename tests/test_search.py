@@ -0,0 +1,44 @@
+__author__ = 'reut'
+
+import random
+import unittest
+
+from connect4.logic import AI
+from tests import make_players, random_board
+
+
+class ParallelSearchTest(unittest.TestCase):
+    def test_parallel_search_matches_search(self):
+        players = make_players(2)
+        for seed in xrange(10):
+            rng = random.Random(seed)
+            board = random_board(rng, players, rng.randint(5, 7), rng.randint(5, 8), 4, rng.randint(0, 10))
+            depth = rng.randint(2, 5)
+            heuristic = AI.AvailableVictoriesHeuristic(board.current_player)
+            score, moves = AI.MinMaxStrategy(heuristic).search(board, depth)
+            strategy = AI.MinMaxStrategy(heuristic)
+            try:
+                parallel_score, parallel_moves = strategy.search_parallel(board, depth, 2)
+            finally:
+                strategy.close()
+            self.assertEqual(parallel_score, score, "seed %d" % seed)
+            # a decided game can be won (or lost) through more than one move
+            if abs(score) != 9998:
+                self.assertEqual(parallel_moves[0], moves[0], "seed %d" % seed)
+
+    def test_parallel_statistics_count_like_search(self):
+        players = make_players(2)
+        board = random_board(random.Random(0), players, 6, 7, 4, 4)
+        heuristic = AI.AvailableVictoriesHeuristic(board.current_player)
+        strategy = AI.MinMaxStrategy(heuristic)
+        try:
+            strategy.search_parallel(board, 4, 2)
+        finally:
+            strategy.close()
+        statistics = strategy.statistics
+        self.assertEqual(statistics.nodes_per_ply[0], 1)
+        self.assertEqual(sum(statistics.nodes_per_ply), statistics.nodes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+__author__ = 'reut'
+
+import random
+import unittest
+
+from connect4.logic.solver import Solver
+from tests import make_players, random_board
+
+
+def brute_force(board, memo):
+    # exact score for the player to move by plain negamax over every move
+    key = board.position_key() + (tuple(board.masks),)
+    if key not in memo:
+        cells = board.rows * board.columns
+        played = sum(board.heights)
+        best = 0 if played == cells else None
+        for move in list(board.valid_moves_iterator):
+            board.put_one(move, record=False)
+            score = (cells + 1 - played) // 2 if board.winner else -brute_force(board, memo)
+            board.undo()
+            if best is None or score > best:
+                best = score
+        memo[key] = best
+    return memo[key]
+
+
+def sign(score):
+    return (score > 0) - (score < 0)
+
+
+class SolverTest(unittest.TestCase):
+    def test_solver_matches_brute_force(self):
+        players = make_players(2)
+        solver = Solver()
+        memo = {}
+        for seed in xrange(40):
+            rng = random.Random(seed)
+            board = random_board(rng, players, 4, 5, 4, rng.randint(6, 20))
+            if board.is_full():
+                continue
+            expected = brute_force(board, memo)
+            self.assertEqual(solver.solve(board), expected, "seed %d" % seed)
+            self.assertEqual(solver.solve(board, weak=True), sign(expected), "seed %d" % seed)
+            move, score = solver.best_move(board)
+            self.assertEqual(score, expected, "seed %d" % seed)
+            board.put_one(move, record=False)
+            if not board.get_winner():
+                self.assertEqual(-brute_force(board, memo), expected, "seed %d" % seed)
+
+    def test_weak_solves_of_decided_positions(self):
+        players = make_players(2)
+        board = random_board(random.Random(0), players, 4, 5, 4, 0)
+        for move in (0, 1, 0, 1, 0, 1):
+            board.put_one(move)
+        # the player to move wins at once
+        self.assertEqual(Solver().solve(board, weak=True), 1)
+        board.put_one(0)
+        # the previous player just won
+        self.assertEqual(Solver().solve(board, weak=True), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()